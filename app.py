@@ -1,16 +1,26 @@
 ﻿import os
-import requests
-from email.mime.text import MIMEText  # se já usa em outros lugares pode manter
 import random
-import smtplib
-from email.mime.text import MIMEText
-from datetime import datetime, date
-import subprocess
+import re
+import time
+import base64
+import io
+import hashlib
+import json
+import csv
+from datetime import datetime, date, timedelta
 import sys
-import shlex
+import uuid
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+import click
 
 from flask import (
     Flask,
+    Request,
     render_template,
     redirect,
     url_for,
@@ -18,8 +28,12 @@ from flask import (
     flash,
     jsonify,
     session,
+    g,
+    stream_template,
 )
+from flask import has_request_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session as FsaSession
 from flask_login import (
     LoginManager,
     UserMixin,
@@ -28,39 +42,242 @@ from flask_login import (
     current_user,
     logout_user,
 )
-from sqlalchemy import text as sa_text
+from sqlalchemy import (
+    delete, event, exists, func, insert, select, text as sa_text, tuple_, update,
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import aliased, joinedload, load_only, selectinload
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
+from busca_fuzzy import IndiceTrigramas
+from importacao import PlanilhaInvalida, booleano, data, inteiro, ler_planilha, normalizar, texto, tipo_planilha
+from migracoes import ErroMigracao, Migrador, adicionar_coluna, colunas, criar_indices
+from fotos import (
+    MINIATURAS, TAMANHO_CABECALHO, FotoInvalida, miniaturas_de_existente, nome_miniatura,
+    processar as processar_foto, tipo_imagem,
+)
+import servidor
+
 # -------------------------------------------------------------------
 # CONFIGURAÃ‡ÃƒO BÃSICA
 # -------------------------------------------------------------------
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_PATH = os.path.join(BASE_DIR, "alunos.db")
 
+
+def _normalizar_url(url):
+    """postgres:// e postgresql:// usam o driver psycopg 3 (requirements.txt)."""
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg://" + url[len("postgresql://"):]
+    return url
+
+
+def _database_uri():
+    """DATABASE_URL do ambiente (ex.: Postgres em produção) ou o SQLite local."""
+    url = os.getenv("DATABASE_URL", "").strip()
+    if not url:
+        return f"sqlite:///{DB_PATH}"
+    return _normalizar_url(url)
+
+
+def _opcoes_engine(uri):
+    """
+    Pool de conexões por processo. Cada worker do gunicorn tem o seu pool,
+    então o orçamento DB_MAX_CONEXOES é dividido pelo número de workers
+    (servidor.workers(), o mesmo do gunicorn.conf.py), a não ser que
+    DB_POOL_SIZE seja informado explicitamente.
+    """
+    if uri.startswith("sqlite"):
+        return {}
+    workers = servidor.workers()
+    max_conexoes = int(os.getenv("DB_MAX_CONEXOES", "20"))
+    pool_size = int(os.getenv("DB_POOL_SIZE", "0")) or max(1, max_conexoes // workers)
+    return {
+        "pool_size": pool_size,
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", str(max(1, pool_size // 2)))),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+    }
+
+
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev-secret"
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}"
+app.config["SQLALCHEMY_DATABASE_URI"] = _database_uri()
+# SQLALCHEMY_ENGINE_OPTIONS: create_app(), pela URI final (_opcoes_engine)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["LOG_CONSULTAS"] = os.getenv("LOG_CONSULTAS") == "1"
+
+# Réplica de leitura (opcional): GETs das listagens vão para ela
+if os.getenv("REPLICA_DATABASE_URL", "").strip():
+    app.config["SQLALCHEMY_BINDS"] = {
+        "replica": _normalizar_url(os.environ["REPLICA_DATABASE_URL"].strip())
+    }
+# Depois de um POST, o usuário lê do primário por N segundos (read-your-writes)
+app.config["REPLICA_STICKY_SEGUNDOS"] = int(os.getenv("REPLICA_STICKY_SEGUNDOS", "30"))
+
+# Paginação (keyset) das listagens
+app.config["ALUNOS_POR_PAGINA"] = int(os.getenv("ALUNOS_POR_PAGINA", "50"))
+app.config["ATIVIDADES_POR_PAGINA"] = int(os.getenv("ATIVIDADES_POR_PAGINA", "50"))
+app.config["POR_PAGINA_MAX"] = int(os.getenv("POR_PAGINA_MAX", "500"))
+
+# Busca tolerante a erros (?fuzzy=1): índice de trigramas por worker.
+# Outros workers não veem as edições na hora; reconstroem após o TTL.
+app.config["BUSCA_FUZZY_TTL"] = int(os.getenv("BUSCA_FUZZY_TTL", "300"))
+
+# Cache de escolas/séries/horários/alunos dos <select> (ver cache_referencia)
+app.config["REF_CACHE_TTL"] = int(os.getenv("REF_CACHE_TTL", "3600"))
+# De quanto em quanto tempo cada worker confere as versões no banco
+app.config["REF_CACHE_CHECK"] = float(os.getenv("REF_CACHE_CHECK", "5"))
+# Snapshot do usuário logado (load_user) guardado no worker
+app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", "60"))
+# Snapshots de usuário guardados por worker (LRU: sai o usado há mais tempo)
+app.config["USER_CACHE_MAX"] = int(os.getenv("USER_CACHE_MAX", "2000"))
 
 # Pasta para uploads de fotos de alunos
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
+# Uploads em andamento (mesmo disco das fotos, para o rename ser atômico)
+app.config["UPLOAD_TMP"] = os.path.join(UPLOAD_FOLDER, ".tmp")
+app.config["FOTO_MAX_BYTES"] = int(os.getenv("FOTO_MAX_BYTES", str(10 * 1024 * 1024)))
+# Import de alunos por planilha (/alunos/importar, flask alunos-importar)
+app.config["IMPORTACAO_MAX_BYTES"] = int(os.getenv("IMPORTACAO_MAX_BYTES", str(20 * 1024 * 1024)))
+app.config["IMPORTACAO_LOTE"] = int(os.getenv("IMPORTACAO_LOTE", "2000"))   # linhas por INSERT/commit
+# Corpo inteiro da requisição: o maior arquivo aceito + os campos do formulário
+app.config["MAX_CONTENT_LENGTH"] = (
+    max(app.config["FOTO_MAX_BYTES"], app.config["IMPORTACAO_MAX_BYTES"]) + 1024 * 1024
+)
+
+# Perfil de PRAGMAs aplicado a cada conexão SQLite do pool
+# ("producao" = WAL + busy_timeout; "padrao" = defaults do SQLite)
+SQLITE_PERFIS = {
+    "padrao": {},
+    "producao": {
+        "journal_mode": "WAL",        # leitores não bloqueiam o escritor
+        "synchronous": "NORMAL",      # seguro com WAL, bem menos fsync
+        "busy_timeout": 5000,         # ms esperando o lock em vez de "database is locked"
+        "cache_size": -20000,         # negativo = KiB (~20 MB por conexão)
+        "mmap_size": 268435456,       # 256 MB
+        "temp_store": "MEMORY",
+    },
+}
+app.config["SQLITE_PERFIL"] = os.getenv("SQLITE_PERFIL", "producao")
+app.config["SQLITE_PRAGMAS"] = dict(SQLITE_PERFIS.get(app.config["SQLITE_PERFIL"], {}))
 
 app.config["SMTP_SERVER"] = "smtp.gmail.com"
 app.config["SMTP_PORT"] = 465
 app.config["SMTP_USER"] = "amos.carvalho@gmail.com"
 app.config["SMTP_PASS"] = "zhswmywmylvkrcnw"
 app.config["SMTP_FROM"] = "amos.carvalho@gmail.com"
+# Sessões SMTP mantidas abertas por processo (ver transporte_email.PoolSMTP)
+app.config["SMTP_POOL_TAMANHO"] = int(os.getenv("SMTP_POOL_TAMANHO", "2"))
+app.config["SMTP_OCIOSO_MAX"] = int(os.getenv("SMTP_OCIOSO_MAX", "60"))   # s parada -> reconecta
+app.config["SMTP_NOOP_APOS"] = int(os.getenv("SMTP_NOOP_APOS", "5"))      # s parada -> NOOP antes de usar
+
+# Fila de envios (e-mail/WhatsApp) processada por `flask fila-worker`
+app.config["FILA_MAX_TENTATIVAS"] = int(os.getenv("FILA_MAX_TENTATIVAS", "6"))
+app.config["FILA_BACKOFF_BASE"] = int(os.getenv("FILA_BACKOFF_BASE", "30"))      # s; dobra a cada falha
+app.config["FILA_BACKOFF_MAX"] = int(os.getenv("FILA_BACKOFF_MAX", "3600"))
+app.config["FILA_LOTE"] = int(os.getenv("FILA_LOTE", "20"))
+app.config["FILA_INTERVALO"] = float(os.getenv("FILA_INTERVALO", "2"))         # s entre varreduras vazias
+app.config["FILA_RESERVA_SEGUNDOS"] = int(os.getenv("FILA_RESERVA_SEGUNDOS", "300"))
+app.config["FILA_RETENCAO_DIAS"] = int(os.getenv("FILA_RETENCAO_DIAS", "30"))      # envios já enviados
+
+# Migrações de dados em lotes (flask db backfill): linhas por transação e pausa entre lotes
+app.config["BACKFILL_LOTE"] = int(os.getenv("BACKFILL_LOTE", "500"))
+app.config["BACKFILL_PAUSA"] = float(os.getenv("BACKFILL_PAUSA", "0.2"))
+
+
+def _limites_canal(canal, concorrencia, taxa, rajada):
+    # FILA_<CANAL>_CONCORRENCIA / _TAXA (mensagens/s) / _RAJADA sobrescrevem o padrão
+    prefixo = f"FILA_{canal.upper()}_"
+    return {
+        "concorrencia": int(os.getenv(prefixo + "CONCORRENCIA", concorrencia)),
+        "taxa": float(os.getenv(prefixo + "TAXA", taxa)),
+        "rajada": int(os.getenv(prefixo + "RAJADA", rajada)),
+    }
+
+
+# Por processo do worker: envios simultâneos e token bucket de cada provedor
+app.config["FILA_LIMITES"] = {
+    "email": _limites_canal("email", 2, 5, 20),
+    "resend": _limites_canal("resend", 4, 50, 100),
+    "whatsapp": _limites_canal("whatsapp", 1, 0.5, 1),   # um navegador só
+}
+
+
+
+
+# Views somente-leitura cujas consultas podem ir para a réplica
+ENDPOINTS_REPLICA = {
+    "alunos_list",
+    "alunos_ver",
+    "atividades_listar",
+    "atividades_list",
+    "horarios_list",
+    "escolas_list",
+    "series_list",
+    "professores_listar",
+}
+
+
+def _ler_da_replica() -> bool:
+    """GET/HEAD de uma view de leitura, sem escrita recente deste usuário."""
+    if not has_request_context() or request.method not in ("GET", "HEAD"):
+        return False
+    if request.endpoint not in ENDPOINTS_REPLICA:
+        return False
+    return session.get("_ler_primario_ate", 0) < time.time()
 
 
+class SessaoRoteada(FsaSession):
+    """
+    Sessão que manda os SELECTs das views de leitura para o bind "replica"
+    (quando configurado). Flush/escritas e todo o resto usam o primário.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and "replica" in self._db.engines
+            and _ler_da_replica()
+        ):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
 
 
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
+# Ligados ao app em create_app(): o import não cria engine nem abre nada
+db = SQLAlchemy(session_options={"class_": SessaoRoteada})
+login_manager = LoginManager()
 login_manager.login_view = "login"
 
 
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.n_consultas = g.get("n_consultas", 0) + 1
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """Aplica app.config["SQLITE_PRAGMAS"] em toda conexão SQLite nova do pool."""
+    import sqlite3
+
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cur = dbapi_connection.cursor()
+    try:
+        for nome, valor in app.config.get("SQLITE_PRAGMAS", {}).items():
+            cur.execute(f"PRAGMA {nome}={valor}")
+    finally:
+        cur.close()
+
+
 # -------------------------------------------------------------------
 # HELPERS
 # -------------------------------------------------------------------
@@ -74,48 +291,342 @@ class HoraStrWrapper:
         return self.text
 
 
-def salvar_foto(file_storage, foto_atual=None):
+class ArquivoRecebido:
     """
-    Salva o arquivo enviado e devolve o caminho relativo "uploads/arquivo.jpg".
-    Se nÃ£o houver arquivo novo, retorna foto_atual (mantÃ©m a existente).
+    Destino de um upload enquanto o Werkzeug lê o corpo da requisição: grava
+    em pedaços num arquivo temporário e calcula o sha256 junto. Se os
+    primeiros bytes não forem de imagem ou o tamanho passar do limite, para
+    de gravar e descarta o resto (`rejeitado` diz o motivo). Arquivo menor
+    que o cabeçalho tem o tipo conferido no fim do upload (seek(0) do
+    Werkzeug). O temporário é apagado no fim da requisição.
     """
-    if not file_storage:
-        return foto_atual
 
-    filename = secure_filename(file_storage.filename or "")
-    if filename == "":
+    def __init__(self, pasta, limite, tipo=tipo_imagem):
+        self.pasta = pasta
+        self.limite = limite
+        self.tipo = tipo                # cabeçalho -> formato ou None
+        self.formato = None
+        self.sha256 = hashlib.sha256()
+        self.tamanho = 0
+        self.rejeitado = None
+        self.caminho = None
+        self._cabecalho = b""
+        self._arquivo = None
+
+    def write(self, dados):
+        if self.rejeitado:
+            return len(dados)
+        self.tamanho += len(dados)
+        if self.tamanho > self.limite:
+            return self._rejeitar("tamanho", len(dados))
+        if len(self._cabecalho) < TAMANHO_CABECALHO:
+            self._cabecalho += dados[:TAMANHO_CABECALHO]
+            if len(self._cabecalho) >= TAMANHO_CABECALHO and not self._conferir_tipo():
+                return self._rejeitar("tipo", len(dados))
+        if self._arquivo is None:
+            os.makedirs(self.pasta, exist_ok=True)
+            self._arquivo = tempfile.NamedTemporaryFile(dir=self.pasta, suffix=".upload", delete=False)
+            self.caminho = self._arquivo.name
+        self.sha256.update(dados)
+        return self._arquivo.write(dados)
+
+    def _conferir_tipo(self):
+        self.formato = self.tipo(self._cabecalho)
+        return self.formato is not None
+
+    def _rejeitar(self, motivo, n):
+        self.rejeitado = motivo
+        self.close()
+        return n
+
+    def finalizar(self):
+        """Upload completo: confere o tipo se o arquivo não chegou a ter o cabeçalho inteiro."""
+        if self._arquivo is not None and not self.rejeitado and self.formato is None:
+            if not self._conferir_tipo():
+                self._rejeitar("tipo", 0)
+
+    def seek(self, *args):
+        self.finalizar()
+        if self._arquivo is not None:
+            self._arquivo.flush()
+            return self._arquivo.seek(*args)
+        return 0
+
+    def read(self, *args):
+        return self._arquivo.read(*args) if self._arquivo is not None and not self.rejeitado else b""
+
+    def readline(self, *args):
+        return self._arquivo.readline(*args) if self._arquivo is not None and not self.rejeitado else b""
+
+    def close(self):
+        if self._arquivo is not None:
+            self._arquivo.close()
+            self._arquivo = None
+        if self.caminho and os.path.exists(self.caminho):
+            os.remove(self.caminho)
+
+
+# endpoint -> (config com o limite de bytes por arquivo, tipos aceitos pelo cabeçalho);
+# uploads dessas rotas passam por ArquivoRecebido
+UPLOADS_VERIFICADOS = {
+    "alunos_novo": ("FOTO_MAX_BYTES", tipo_imagem),
+    "alunos_new": ("FOTO_MAX_BYTES", tipo_imagem),
+    "alunos_editar": ("FOTO_MAX_BYTES", tipo_imagem),
+    "alunos_importar": ("IMPORTACAO_MAX_BYTES", tipo_planilha),
+}
+
+
+class Requisicao(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        politica = UPLOADS_VERIFICADOS.get(self.endpoint)
+        if politica is None:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        limite, tipo = politica
+        return ArquivoRecebido(app.config["UPLOAD_TMP"], app.config[limite], tipo)
+
+
+app.request_class = Requisicao
+
+
+def _limite_mb(chave="FOTO_MAX_BYTES"):
+    return f"{app.config[chave] / (1024 * 1024):g} MB"
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def _upload_grande_demais(e):
+    chave = UPLOADS_VERIFICADOS.get(request.endpoint, ("FOTO_MAX_BYTES",))[0]
+    flash(f"Arquivo grande demais (máximo {_limite_mb(chave)}).", "warning")
+    return redirect(request.referrer or url_for("index"))
+
+
+def _base_foto(sha):
+    return f"uploads/{sha[:2]}/{sha[2:4]}/{sha}"
+
+
+def preparar_foto(file_storage):
+    """
+    Parte do upload que não usa o banco: confere o arquivo e grava a foto
+    processada no armazenamento por hash (uploads/ab/cd/<sha256>.jpg).
+    Chamada depois de validar o formulário (um erro ali não deixa arquivo
+    gravado à toa) e antes de qualquer escrita, para o processamento da
+    imagem não acontecer com o banco travado. Devolve o sha256 ou None.
+    """
+    if not file_storage or secure_filename(file_storage.filename or "") == "":
+        return None
+
+    stream = file_storage.stream
+    if isinstance(stream, ArquivoRecebido):
+        if stream.rejeitado == "tamanho":
+            flash(f"Foto maior que {_limite_mb()}; a foto não foi alterada.", "warning")
+            return None
+        if stream.rejeitado or not stream.caminho:
+            flash("O arquivo enviado não é uma imagem válida; a foto não foi alterada.", "warning")
+            return None
+        sha = stream.sha256.hexdigest()
+        origem = stream.caminho
+    else:
+        h = hashlib.sha256()
+        for bloco in iter(lambda: stream.read(64 * 1024), b""):
+            h.update(bloco)
+        stream.seek(0)
+        sha = h.hexdigest()
+        origem = stream
+
+    destino = os.path.join(app.static_folder, _base_foto(sha))
+    if not os.path.exists(destino + ".jpg"):
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        try:
+            processar_foto(origem, destino)
+        except FotoInvalida:
+            flash("O arquivo enviado não é uma imagem válida; a foto não foi alterada.", "warning")
+            return None
+    return sha
+
+
+def registrar_foto(sha, foto_atual=None):
+    """
+    Aponta o aluno para a foto `sha` (já gravada por preparar_foto) e ajusta
+    as referências: o mesmo arquivo enviado para dois alunos é gravado uma
+    vez só e conta duas. Sem foto nova (sha None) mantém foto_atual.
+    Quem chama faz o commit e depois coletar_fotos_orfas().
+    """
+    if not sha:
+        return foto_atual
+    caminho = f"{_base_foto(sha)}.jpg"
+    if caminho == foto_atual:
         return foto_atual
 
-    caminho = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file_storage.save(caminho)
-    return f"uploads/{filename}"
+    # Um comando só (INSERT ... ON CONFLICT): dois uploads simultâneos da
+    # mesma imagem não disputam quem cria a linha
+    if db.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as insert_upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_upsert
+    db.session.execute(
+        insert_upsert(Foto)
+        .values(sha256=sha, caminho=caminho, referencias=1, criado_em=datetime.utcnow())
+        .on_conflict_do_update(
+            index_elements=[Foto.sha256], set_={"referencias": Foto.referencias + 1}
+        )
+    )
+    liberar_foto(foto_atual)
+    return caminho
 
 
-def enviar_codigo_email(email, codigo) -> bool:
-    from email.mime.text import MIMEText
-    import smtplib
+def liberar_foto(foto_path):
+    """Tira uma referência da foto; os arquivos saem em coletar_fotos_orfas()."""
+    if foto_path:
+        db.session.execute(
+            update(Foto).where(Foto.caminho == foto_path).values(referencias=Foto.referencias - 1)
+        )
+
+
+def _apagar_arquivos_foto(foto_path):
+    arquivos = [foto_path] + [nome_miniatura(foto_path, t) for t in MINIATURAS]
+    for rel in arquivos:
+        try:
+            os.remove(os.path.join(app.static_folder, rel))
+        except FileNotFoundError:
+            pass
+
+
+def coletar_fotos_orfas():
+    """
+    Apaga registro e arquivos das fotos que ficaram sem nenhum aluno (após o
+    commit). O DELETE repete a condição: se um upload da mesma imagem
+    reaproveitou a foto depois do SELECT, ela fica, e os arquivos também.
+    """
+    orfas = db.session.execute(
+        select(Foto.sha256, Foto.caminho).where(Foto.referencias <= 0)
+    ).all()
+    if not orfas:
+        return 0
+    caminhos = []
+    for sha256, caminho in orfas:
+        res = db.session.execute(
+            delete(Foto).where(Foto.sha256 == sha256, Foto.referencias <= 0)
+        )
+        if res.rowcount == 1:
+            caminhos.append(caminho)
+    db.session.commit()
+    for caminho in caminhos:
+        _apagar_arquivos_foto(caminho)
+    return len(caminhos)
+
 
-    msg = MIMEText(f"Seu código para redefinição de senha é: {codigo}")
-    msg["Subject"] = "Recuperação de senha - Sistema Escolar"
-    msg["From"] = app.config["SMTP_FROM"]
-    msg["To"] = email
+@app.template_filter("miniatura")
+def miniatura(foto_path, tamanho=64):
+    """Caminho da miniatura da foto; fotos antigas sem miniatura usam o original."""
+    if not foto_path:
+        return foto_path
+    mini = nome_miniatura(foto_path, tamanho)
+    if os.path.exists(os.path.join(app.static_folder, mini)):
+        return mini
+    return foto_path
 
+
+def _tamanho_pagina(valor, padrao):
+    """Converte ?por_pagina=N em inteiro, limitado a [1, POR_PAGINA_MAX]."""
     try:
-        servidor = smtplib.SMTP_SSL(
+        n = int(valor) if valor else padrao
+    except (TypeError, ValueError):
+        n = padrao
+    return max(1, min(n, app.config["POR_PAGINA_MAX"]))
+
+
+def _codificar_cursor(*valores) -> str:
+    """
+    Gera o cursor opaco da paginação keyset a partir da chave de ordenação
+    do último item da página (ex.: (nome, id)). Datas viram ISO 8601.
+    """
+    dados = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in valores]
+    bruto = json.dumps(dados, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+
+def _decodificar_cursor(token, *tipos):
+    """
+    Inverso de _codificar_cursor; `tipos` é o tipo JSON de cada campo (ex.:
+    str, int). Cursor inválido ou adulterado -> None (volta ao início).
+    """
+    if not token:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        dados = json.loads(bruto.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(dados, list) or len(dados) != len(tipos):
+        return None
+    for valor, tipo in zip(dados, tipos):
+        # bool é subclasse de int, mas true/false não é id
+        if not isinstance(valor, tipo) or isinstance(valor, bool):
+            return None
+    return dados
+
+
+def _parse_data(valor):
+    """'YYYY-MM-DD' -> date; vazio ou inválido -> None."""
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+ASSUNTO_RECUPERACAO = "Recuperação de senha - Sistema Escolar"
+
+
+def texto_codigo_email(codigo) -> str:
+    return f"Seu código para redefinição de senha é: {codigo}"
+
+
+_transportes = {}
+
+
+def pool_smtp():
+    """Pool SMTP do processo, criado no primeiro uso (depois do fork)."""
+    if "smtp" not in _transportes:
+        from transporte_email import PoolSMTP  # smtplib/email só em quem envia
+
+        _transportes["smtp"] = PoolSMTP(
             app.config["SMTP_SERVER"],
             app.config["SMTP_PORT"],
-            timeout=20
-        )
-        servidor.login(
             app.config["SMTP_USER"],
-            app.config["SMTP_PASS"]
+            app.config["SMTP_PASS"],
+            remetente=app.config["SMTP_FROM"],
+            tamanho=app.config["SMTP_POOL_TAMANHO"],
+            ocioso_max=app.config["SMTP_OCIOSO_MAX"],
+            noop_apos=app.config["SMTP_NOOP_APOS"],
         )
-        servidor.sendmail(
-            app.config["SMTP_USER"],
-            [email],
-            msg.as_string()
-        )
-        servidor.quit()
+    return _transportes["smtp"]
+
+
+def cliente_resend():
+    """Cliente Resend do processo, ou None sem RESEND_API_KEY."""
+    if "resend" not in _transportes:
+        from transporte_email import ClienteResend
+
+        api_key = os.getenv("RESEND_API_KEY", "").strip()
+        remetente = os.getenv("RESEND_FROM", "Sistema Escolar <onboarding@resend.dev>").strip()
+        _transportes["resend"] = ClienteResend(api_key, remetente) if api_key else None
+    return _transportes["resend"]
+
+
+def enviar_email_smtp(email, assunto, corpo):
+    """Envia um e-mail pelo SMTP configurado. Erros sobem para quem chamou."""
+    pool_smtp().enviar(email, assunto, corpo)
+
+
+def enviar_emails_smtp_lote(mensagens):
+    """[(destino, assunto, corpo)] -> [None | erro], numa sessão SMTP só."""
+    return pool_smtp().enviar_lote(mensagens)
+
+
+def enviar_codigo_email(email, codigo) -> bool:
+    try:
+        enviar_email_smtp(email, ASSUNTO_RECUPERACAO, texto_codigo_email(codigo))
         return True
     except Exception as e:
         print("Erro ao enviar e-mail:", e)
@@ -128,10 +639,8 @@ def enviar_email_generico(destinatarios, assunto, mensagem) -> bool:
     Envia e-mail genérico via Resend (API HTTP).
     destinatarios pode ser string com ; ou , ou lista.
     """
-    api_key = os.getenv("RESEND_API_KEY", "").strip()
-    remetente = os.getenv("RESEND_FROM", "Sistema Escolar <onboarding@resend.dev>").strip()
-
-    if not api_key:
+    cliente = cliente_resend()
+    if cliente is None:
         print("RESEND: faltando RESEND_API_KEY nas variáveis de ambiente.")
         return False
 
@@ -145,62 +654,59 @@ def enviar_email_generico(destinatarios, assunto, mensagem) -> bool:
         return False
 
     try:
-        r = requests.post(
-            "https://api.resend.com/emails",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "from": remetente,
-                "to": lista,
-                "subject": assunto,
-                "text": mensagem,
-            },
-            timeout=20,
-        )
-
-        if r.status_code in (200, 201):
-            return True
-
-        print("Erro Resend:", r.status_code, r.text)
-        return False
-
+        cliente.enviar(lista, assunto, mensagem)
+        return True
     except Exception as e:
         print("Erro ao enviar e-mail (Resend):", e)
         return False
 
 
+def enviar_email_resend(destinatarios, assunto, mensagem):
+    """Como enviar_email_generico, mas o erro sobe (usado pela fila)."""
+    cliente = cliente_resend()
+    if cliente is None:
+        raise RuntimeError("RESEND_API_KEY não configurada")
+    cliente.enviar(destinatarios, assunto, mensagem)
+
 
-def enviar_codigo_whatsapp(numero, codigo) -> bool:
+def enviar_email_generico_lote(mensagens):
+    """
+    Envio em massa via Resend: [(destinatarios, assunto, mensagem)] ->
+    [None | erro], até 100 mensagens por requisição HTTP.
     """
-    Usa o script externo enviar_whatsapp.py para automatizar o WhatsApp Web
-    e enviar a mensagem em background (headless, depois do primeiro login).
+    cliente = cliente_resend()
+    if cliente is None:
+        return ["RESEND_API_KEY não configurada"] * len(mensagens)
+    return cliente.enviar_lote(mensagens)
 
-    - numero: string com o nÃºmero (pode ter +, espaÃ§os, etc. -> serÃ¡ limpo).
-    - codigo: cÃ³digo numÃ©rico a ser enviado.
 
-    Retorna True se o script terminar com exit code 0, False caso contrÃ¡rio.
+
+def texto_codigo_whatsapp(codigo) -> str:
+    return f"Seu código de recuperação é: {codigo}"
+
+
+def sessao_whatsapp():
+    """
+    Navegador do WhatsApp Web do processo, aberto no primeiro envio e mantido
+    logado. Só o worker `flask fila-worker --canal whatsapp` chega aqui.
     """
-    numero_limpo = "".join(filter(str.isdigit, numero))
-    mensagem = f"Seu cÃ³digo de recuperaÃ§Ã£o Ã©: {codigo}"
+    if "whatsapp" not in _transportes:
+        from enviar_whatsapp import SessaoWhatsApp
+        _transportes["whatsapp"] = SessaoWhatsApp()
+    return _transportes["whatsapp"]
 
-    # Monta comando: python enviar_whatsapp.py NUMERO "mensagem"
-    cmd = f'{sys.executable} enviar_whatsapp.py {numero_limpo} "{mensagem}"'
 
-    try:
-        resultado = subprocess.run(
-            shlex.split(cmd),
-            capture_output=True,
-            # text=True,
-            timeout=180,
-        )
-        print("STDOUT enviar_whatsapp:", resultado.stdout)
-        print("STDERR enviar_whatsapp:", resultado.stderr)
-        return resultado.returncode == 0
-    except Exception as e:
-        print("Erro ao chamar enviar_whatsapp.py:", e)
-        return False
+def enviar_whatsapp(numero, assunto, mensagem):
+    """Enviador da fila para o canal "whatsapp" (assunto não se aplica)."""
+    sessao_whatsapp().enviar("".join(filter(str.isdigit, numero)), mensagem)
+
+
+def fechar_transportes():
+    """Fecha conexões SMTP e o navegador do WhatsApp deste processo."""
+    for transporte in _transportes.values():
+        if transporte is not None and hasattr(transporte, "fechar"):
+            transporte.fechar()
+    _transportes.clear()
 
 
 def _is_hhmm(val: str) -> bool:
@@ -213,17 +719,8 @@ def _is_hhmm(val: str) -> bool:
 # -------------------------------------------------------------------
 # MODELOS
 # -------------------------------------------------------------------
-class Usuario(db.Model, UserMixin):
-    __tablename__ = "usuario"
-    id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    senha_hash = db.Column(db.String(255), nullable=False)
-    papel = db.Column(db.String(30), nullable=False, default="ALUNO")
-    ativo = db.Column(db.Boolean, nullable=False, default=True)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-
-    aluno_id = db.Column(db.Integer, db.ForeignKey("aluno.id"), nullable=True)
-    aluno = db.relationship("Aluno", lazy="joined")
+class PapelMixin:
+    """Checagens de papel comuns ao modelo Usuario e ao snapshot UsuarioSessao."""
 
     def papel_upper(self):
         return (self.papel or "").upper()
@@ -241,6 +738,35 @@ class Usuario(db.Model, UserMixin):
         return self.papel_upper() == "ALUNO"
 
 
+class Usuario(PapelMixin, db.Model, UserMixin):
+    __tablename__ = "usuario"
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    senha_hash = db.Column(db.String(255), nullable=False)
+    papel = db.Column(db.String(30), nullable=False, default="ALUNO")
+    ativo = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    aluno_id = db.Column(db.Integer, db.ForeignKey("aluno.id"), nullable=True, index=True)
+    # Relacionamentos são lazy por padrão; cada rota pede o que usa
+    # (joinedload/selectinload/load_only) em vez de JOINs em toda consulta.
+    aluno = db.relationship("Aluno")
+
+
+class UsuarioSessao(PapelMixin, UserMixin):
+    """
+    Snapshot imutável do usuário logado (id, email, papel, ativo, aluno_id),
+    desacoplado da sessão do banco para poder ficar em cache entre requisições.
+    """
+
+    def __init__(self, id, email, papel, ativo, aluno_id):
+        self.id = id
+        self.email = email
+        self.papel = papel
+        self.ativo = ativo
+        self.aluno_id = aluno_id
+
+
 class Escola(db.Model):
     __tablename__ = "escola"
     id = db.Column(db.Integer, primary_key=True)
@@ -266,12 +792,12 @@ class Professor(db.Model):
 
     # Email precisa existir em Usuario (vÃ­nculo)
     usuario_id = db.Column(db.Integer, db.ForeignKey("usuario.id"), nullable=False, unique=True)
-    usuario = db.relationship("Usuario", lazy="joined")
+    usuario = db.relationship("Usuario")
 
     nome = db.Column(db.String(120), nullable=False)
     data_nascimento = db.Column(db.Date, nullable=True)
 
-    series = db.relationship("Serie", secondary=professor_serie, lazy="subquery")
+    series = db.relationship("Serie", secondary=professor_serie)
 
     def series_str(self):
         return ", ".join([s.nome for s in self.series]) if self.series else ""
@@ -316,9 +842,16 @@ class Aluno(db.Model):
     inicio_aulas = db.Column(db.Date)
     mensalidade_opcao = db.Column(db.String(60))
 
-    escola = db.relationship("Escola", lazy="joined")
-    serie = db.relationship("Serie", lazy="joined")
-    horario = db.relationship("Horario", lazy="joined")
+    escola = db.relationship("Escola")
+    serie = db.relationship("Serie")
+    horario = db.relationship("Horario")
+
+
+# Índices das consultas quentes (ver `flask index-advisor`)
+db.Index("ix_aluno_nome", Aluno.nome, Aluno.id)                  # listagem keyset / selects
+db.Index("ix_aluno_horario_nome", Aluno.horario_id, Aluno.nome)  # quadro de horários
+db.Index("ix_aluno_serie", Aluno.serie_id)
+db.Index("ix_aluno_escola", Aluno.escola_id)
 
 
 class Atividade(db.Model):
@@ -331,15 +864,607 @@ class Atividade(db.Model):
     conteudo = db.Column(db.Text, nullable=False)
     observacao = db.Column(db.Text)
 
-    aluno = db.relationship("Aluno", lazy="joined")
+    aluno = db.relationship("Aluno")
+
+
+# Opções de carga reutilizadas pelas rotas
+ALUNO_COM_REFERENCIAS = (
+    joinedload(Aluno.escola),
+    joinedload(Aluno.serie),
+    joinedload(Aluno.horario),
+)
+
+
+db.Index(
+    "ix_atividade_aluno_data",
+    Atividade.aluno_id,
+    Atividade.data.desc(),
+    Atividade.id.desc(),
+)
+db.Index("ix_atividade_data", Atividade.data.desc(), Atividade.id.desc())
+db.Index("ix_horario_inicio", Horario.hora_inicio)
+db.Index("ix_professor_nome", Professor.nome)
+
+
+class CacheVersao(db.Model):
+    """Contador de versão por tipo de dado de referência (invalidação entre workers)."""
+    __tablename__ = "cache_versao"
+    nome = db.Column(db.String(40), primary_key=True)
+    versao = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Foto(db.Model):
+    """Foto gravada pelo hash do conteúdo; `referencias` = alunos que a usam."""
+    __tablename__ = "foto"
+    sha256 = db.Column(db.String(64), primary_key=True)
+    caminho = db.Column(db.String(300), nullable=False, unique=True)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class Envio(db.Model):
+    """Mensagem na fila de saída (status: pendente -> processando -> enviado)."""
+    __tablename__ = "fila_envio"
+    id = db.Column(db.Integer, primary_key=True)
+    canal = db.Column(db.String(20), nullable=False)        # "email", "whatsapp"
+    destino = db.Column(db.String(180), nullable=False)
+    assunto = db.Column(db.String(200))
+    mensagem = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pendente")
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    reservado_ate = db.Column(db.DateTime)
+    ultimo_erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    enviado_em = db.Column(db.DateTime)
+    comunicado_id = db.Column(db.Integer, db.ForeignKey("comunicado.id"))
+
+
+db.Index("ix_fila_envio_status", Envio.status, Envio.proxima_tentativa)
+db.Index("ix_fila_envio_comunicado", Envio.comunicado_id, Envio.status)
+
+
+class EnvioFalho(db.Model):
+    """Dead letter: mensagens que esgotaram FILA_MAX_TENTATIVAS."""
+    __tablename__ = "fila_envio_falha"
+    id = db.Column(db.Integer, primary_key=True)
+    envio_id = db.Column(db.Integer, nullable=False)
+    canal = db.Column(db.String(20), nullable=False)
+    destino = db.Column(db.String(180), nullable=False)
+    assunto = db.Column(db.String(200))
+    mensagem = db.Column(db.Text, nullable=False)
+    tentativas = db.Column(db.Integer, nullable=False)
+    ultimo_erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False)
+    falhou_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    comunicado_id = db.Column(db.Integer, index=True)
+
+
+class Comunicado(db.Model):
+    """Mensagem para os responsáveis de uma série ou horário (um Envio por destinatário)."""
+    __tablename__ = "comunicado"
+    id = db.Column(db.Integer, primary_key=True)
+    alvo = db.Column(db.String(20), nullable=False)          # "serie" ou "horario"
+    alvo_id = db.Column(db.Integer, nullable=False)
+    canais = db.Column(db.String(60), nullable=False)        # "email,whatsapp"
+    assunto = db.Column(db.String(200), nullable=False)
+    mensagem = db.Column(db.Text, nullable=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    criado_por = db.Column(db.Integer, db.ForeignKey("usuario.id"))
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class AlunoImportacao(db.Model):
+    """
+    Staging do import por planilha: uma linha da planilha já convertida,
+    com o erro de validação (se houver). Os lotes vivem só durante o import.
+    """
+    __tablename__ = "aluno_importacao"
+    id = db.Column(db.Integer, primary_key=True)
+    lote = db.Column(db.String(32), nullable=False)
+    linha = db.Column(db.Integer, nullable=False)
+    erro = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    nome = db.Column(db.String(180))
+    escola_id = db.Column(db.Integer)
+    serie_id = db.Column(db.Integer)
+    horario_id = db.Column(db.Integer)
+    telefone_cel = db.Column(db.String(30))
+    telefone_fixo = db.Column(db.String(30))
+    observacoes = db.Column(db.Text)
+    naturalidade = db.Column(db.String(120))
+    nacionalidade = db.Column(db.String(120))
+    data_nascimento = db.Column(db.Date)
+    idade = db.Column(db.Integer)
+    sexo = db.Column(db.String(1))
+    nome_pai = db.Column(db.String(180))
+    nome_mae = db.Column(db.String(180))
+    endereco = db.Column(db.String(200))
+    numero = db.Column(db.String(20))
+    bairro = db.Column(db.String(120))
+    tem_dificuldade = db.Column(db.Boolean)
+    qual_dificuldade = db.Column(db.String(255))
+    toma_medicamento = db.Column(db.Boolean)
+    qual_medicamento = db.Column(db.String(255))
+    inicio_aulas = db.Column(db.Date)
+    mensalidade_opcao = db.Column(db.String(60))
+
+
+db.Index("ix_aluno_importacao_lote", AlunoImportacao.lote, AlunoImportacao.nome)
+
+# Colunas copiadas do staging para aluno
+CAMPOS_IMPORTACAO = (
+    "nome", "escola_id", "serie_id", "horario_id", "telefone_cel", "telefone_fixo",
+    "observacoes", "naturalidade", "nacionalidade", "data_nascimento", "idade", "sexo",
+    "nome_pai", "nome_mae", "endereco", "numero", "bairro", "tem_dificuldade",
+    "qual_dificuldade", "toma_medicamento", "qual_medicamento", "inicio_aulas",
+    "mensalidade_opcao",
+)
+
+
+# -------------------------------------------------------------------
+# CACHE DE DADOS DE REFERÊNCIA
+# -------------------------------------------------------------------
+_ref_cache = {}                            # chave -> (versao, expira_em, valor)
+_ref_versoes = {"lidas_em": 0.0, "valores": {}}
+
+
+def _versoes_referencia():
+    """Versões do banco, relidas no máximo a cada REF_CACHE_CHECK segundos."""
+    agora = time.time()
+    if agora - _ref_versoes["lidas_em"] > app.config["REF_CACHE_CHECK"]:
+        # conexão própria: um erro aqui não desfaz o que a sessão da
+        # requisição tem pendente
+        try:
+            with db.engine.connect() as conn:
+                linhas = conn.execute(select(CacheVersao.nome, CacheVersao.versao)).all()
+        except OperationalError:
+            # tabela ainda não criada (antes do `flask db upgrade`): só o TTL vale
+            linhas = []
+        _ref_versoes["valores"] = dict(linhas)
+        _ref_versoes["lidas_em"] = agora
+    return _ref_versoes["valores"]
+
+
+def cache_referencia(chave, carregar, versao_de=None, ttl=None):
+    """
+    Devolve o valor em cache para `chave` ou chama carregar() e guarda.
+    Expira pelo TTL ou quando outro worker incrementa a versão no banco
+    (a versão de `versao_de`, por padrão a da própria chave).
+    Guarde só valores imutáveis (Rows/tuplas/snapshots), nunca objetos ORM.
+    """
+    versao = _versoes_referencia().get(versao_de or chave, 0)
+    item = _ref_cache.get(chave)
+    if item and item[0] == versao and item[1] > time.time():
+        return item[2]
+    valor = carregar()
+    ttl = app.config["REF_CACHE_TTL"] if ttl is None else ttl
+    _ref_cache[chave] = (versao, time.time() + ttl, valor)
+    return valor
+
+
+def invalidar_referencias(*chaves):
+    """Chamado pelas rotas de escrita: limpa o cache local e avisa os outros workers."""
+    for chave in chaves:
+        _ref_cache.pop(chave, None)
+        incrementar = (
+            update(CacheVersao)
+            .where(CacheVersao.nome == chave)
+            .values(versao=CacheVersao.versao + 1)
+        )
+        if db.session.execute(incrementar).rowcount:
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(CacheVersao(nome=chave, versao=1))
+        except IntegrityError:
+            # outro worker criou a linha entre o UPDATE e o INSERT
+            db.session.execute(incrementar)
+    db.session.commit()
+    _ref_versoes["lidas_em"] = 0.0
+
+
+# -------------------------------------------------------------------
+# FILA DE ENVIOS (processada fora das requisições: flask fila-worker)
+# -------------------------------------------------------------------
+# canal -> função(destino, assunto, mensagem); exceção = falha com retry
+ENVIADORES = {
+    "email": enviar_email_smtp,
+    "resend": enviar_email_resend,
+    "whatsapp": enviar_whatsapp,
+}
+# canal -> função([(destino, assunto, mensagem)]) -> [None | erro], mesma ordem
+ENVIADORES_LOTE = {
+    "email": enviar_emails_smtp_lote,
+    "resend": enviar_email_generico_lote,
+}
+
+
+class BaldeTokens:
+    """Token bucket: `taxa` tokens por segundo, acumulando até `capacidade`."""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consumir(self, n=1):
+        """Bloqueia até haver `n` tokens. O saldo pode ficar negativo: quem
+        vem depois espera a dívida ser paga, então a taxa vale entre threads."""
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            self._tokens -= n
+            espera = -self._tokens / self.taxa if self._tokens < 0 else 0
+        if espera > 0:
+            time.sleep(espera)
+
+
+_baldes = {}
+
+
+def _balde(canal):
+    if canal not in _baldes:
+        limites = app.config["FILA_LIMITES"].get(canal)
+        _baldes[canal] = (
+            BaldeTokens(limites["taxa"], limites["rajada"])
+            if limites and limites["taxa"] > 0 else None
+        )
+    return _baldes[canal]
+
+
+def enfileirar(canal, destino, mensagem, assunto=None, commit=True):
+    """Grava a mensagem na fila e volta na hora; quem envia é o worker."""
+    if canal not in ENVIADORES:
+        raise ValueError(f"Canal de envio desconhecido: {canal}")
+    envio = Envio(canal=canal, destino=destino, assunto=assunto, mensagem=mensagem)
+    db.session.add(envio)
+    if commit:
+        db.session.commit()
+    return envio
+
+
+def _atraso_retry(tentativas: int) -> float:
+    """Backoff exponencial com jitter: base * 2^(n-1), limitado a FILA_BACKOFF_MAX."""
+    atraso = min(
+        app.config["FILA_BACKOFF_BASE"] * 2 ** (tentativas - 1),
+        app.config["FILA_BACKOFF_MAX"],
+    )
+    return atraso * random.uniform(0.8, 1.2)
+
+
+def _reservar_envios(limite, canais=None):
+    """
+    Reserva até `limite` envios vencidos num único UPDATE ... RETURNING. A
+    condição repetida no UPDATE garante que dois workers não peguem a mesma
+    mensagem (no Postgres o SELECT ainda pula as linhas travadas por outro
+    worker); reservas de um worker que morreu expiram após
+    FILA_RESERVA_SEGUNDOS.
+    """
+    agora = datetime.utcnow()
+    livre = (Envio.status == "pendente") | (
+        (Envio.status == "processando") & (Envio.reservado_ate < agora)
+    )
+    stmt = select(Envio.id).where(livre, Envio.proxima_tentativa <= agora)
+    if canais:
+        stmt = stmt.where(Envio.canal.in_(canais))
+    ids = db.session.execute(
+        stmt.order_by(Envio.proxima_tentativa, Envio.id)
+        .limit(limite)
+        .with_for_update(skip_locked=True)   # ignorado no SQLite
+    ).scalars().all()
+    if not ids:
+        db.session.commit()
+        return []
+
+    reserva = agora + timedelta(seconds=app.config["FILA_RESERVA_SEGUNDOS"])
+    reservados = db.session.execute(
+        update(Envio)
+        .where(Envio.id.in_(ids), livre)
+        .values(status="processando", reservado_ate=reserva)
+        .returning(Envio.id),
+        execution_options={"synchronize_session": False},
+    ).scalars().all()
+    db.session.commit()
+    return reservados
+
+
+def limpar_enviados():
+    """Apaga da fila os envios enviados há mais de FILA_RETENCAO_DIAS."""
+    limite = datetime.utcnow() - timedelta(days=app.config["FILA_RETENCAO_DIAS"])
+    res = db.session.execute(
+        delete(Envio).where(Envio.status == "enviado", Envio.enviado_em < limite)
+    )
+    db.session.commit()
+    return res.rowcount
+
+
+class FalhaPermanente(str):
+    """
+    Erro de envio que não adianta repetir (ex.: número sem WhatsApp). Os
+    enviadores sinalizam com uma exceção de atributo `permanente = True`.
+    """
+
+
+def _registrar_resultado(envio, erro):
+    """
+    erro None = enviado; senão agenda o retry ou move para a dead letter
+    (na hora, se o erro for uma FalhaPermanente).
+    """
+    envio.tentativas += 1
+    envio.reservado_ate = None
+    if erro is None:
+        envio.status = "enviado"
+        envio.enviado_em = datetime.utcnow()
+        return
+
+    envio.ultimo_erro = str(erro)[:2000]
+    if isinstance(erro, FalhaPermanente) or envio.tentativas >= app.config["FILA_MAX_TENTATIVAS"]:
+        db.session.add(EnvioFalho(
+            envio_id=envio.id, canal=envio.canal, destino=envio.destino,
+            assunto=envio.assunto, mensagem=envio.mensagem,
+            tentativas=envio.tentativas, ultimo_erro=envio.ultimo_erro,
+            criado_em=envio.criado_em, comunicado_id=envio.comunicado_id,
+        ))
+        db.session.delete(envio)
+    else:
+        envio.status = "pendente"
+        envio.proxima_tentativa = datetime.utcnow() + timedelta(
+            seconds=_atraso_retry(envio.tentativas)
+        )
+
+
+def _enviar_canal(canal, mensagens):
+    """
+    Envia [(destino, assunto, mensagem)] de um canal respeitando o limite de
+    envios simultâneos e a taxa do canal. Devolve [None | erro], mesma ordem.
+    """
+    limites = app.config["FILA_LIMITES"].get(canal, {})
+    concorrencia = max(1, limites.get("concorrencia", 1))
+    balde = _balde(canal)
+    lote = ENVIADORES_LOTE.get(canal)
+
+    if lote:
+        tamanho = -(-len(mensagens) // concorrencia)
+        partes = [mensagens[i:i + tamanho] for i in range(0, len(mensagens), tamanho)]
+    else:
+        partes = [[m] for m in mensagens]
+
+    def enviar_parte(parte):
+        if balde:
+            balde.consumir(len(parte))
+        try:
+            if lote:
+                return lote(parte)
+            ENVIADORES[canal](*parte[0])
+            return [None]
+        except Exception as e:
+            erro = f"{type(e).__name__}: {e}"
+            if getattr(e, "permanente", False):
+                erro = FalhaPermanente(erro)
+            return [erro] * len(parte)
+
+    if concorrencia == 1 or len(partes) == 1:
+        resultados = [enviar_parte(p) for p in partes]
+    else:
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            resultados = list(executor.map(enviar_parte, partes))
+    return [erro for parte in resultados for erro in parte]
+
+
+def processar_fila(limite=None, canais=None):
+    """
+    Processa um lote da fila. Canais com enviador em lote mandam as
+    mensagens reservadas de uma vez (uma sessão SMTP / um POST), divididas
+    pela concorrência do canal. Devolve (enviados, falhas).
+    """
+    ids = _reservar_envios(limite or app.config["FILA_LOTE"], canais)
+    if not ids:
+        return 0, 0
+    envios = db.session.execute(
+        select(Envio).where(Envio.id.in_(ids)).order_by(Envio.id)
+    ).scalars().all()
+
+    por_canal = {}
+    for envio in envios:
+        por_canal.setdefault(envio.canal, []).append(envio)
+
+    enviados = falhas = 0
+    for canal, lista in por_canal.items():
+        erros = _enviar_canal(canal, [(e.destino, e.assunto, e.mensagem) for e in lista])
+        for envio, erro in zip(lista, erros):
+            _registrar_resultado(envio, erro)
+            if erro is None:
+                enviados += 1
+            else:
+                falhas += 1
+        db.session.commit()
+    return enviados, falhas
+
+
+# -------------------------------------------------------------------
+# COMUNICADOS (envio em massa para responsáveis)
+# -------------------------------------------------------------------
+CANAIS_COMUNICADO = ("email", "whatsapp")
+
+
+def _canal_email_em_massa():
+    # Com Resend configurado, o e-mail em massa vai pela API (lotes de 100)
+    return "resend" if os.getenv("RESEND_API_KEY", "").strip() else "email"
+
+
+def destinatarios_comunicado(alvo, alvo_id, canais):
+    """
+    (canal, destino) sem repetição para os responsáveis dos alunos da
+    série/horário: e-mail dos usuários RESPONSAVEL vinculados ao aluno e
+    WhatsApp pelo celular cadastrado no aluno.
+    """
+    coluna = Aluno.serie_id if alvo == "serie" else Aluno.horario_id
+    alunos = select(Aluno.id).where(coluna == alvo_id)
+    destinos = []
+
+    if "email" in canais:
+        canal_email = _canal_email_em_massa()
+        emails = db.session.execute(
+            select(Usuario.email)
+            .where(
+                Usuario.aluno_id.in_(alunos),
+                func.upper(Usuario.papel) == "RESPONSAVEL",
+                Usuario.ativo.is_(True),
+            )
+            .distinct()
+        ).scalars()
+        destinos += [(canal_email, e) for e in emails if e]
+
+    if "whatsapp" in canais:
+        vistos = set()
+        for tel in db.session.execute(
+            select(Aluno.telefone_cel).where(coluna == alvo_id, Aluno.telefone_cel.isnot(None))
+        ).scalars():
+            numero = "".join(filter(str.isdigit, tel))
+            if len(numero) >= 10 and numero not in vistos:
+                vistos.add(numero)
+                destinos.append(("whatsapp", numero))
+
+    return destinos
+
+
+def criar_comunicado(alvo, alvo_id, assunto, mensagem, canais, usuario_id=None):
+    """Grava o comunicado e um Envio por destinatário (INSERT em lote)."""
+    com = Comunicado(
+        alvo=alvo, alvo_id=alvo_id, canais=",".join(canais),
+        assunto=assunto, mensagem=mensagem, criado_por=usuario_id,
+    )
+    db.session.add(com)
+    db.session.flush()
+
+    texto_whatsapp = f"*{assunto}*\n{mensagem}"
+    linhas = [
+        {
+            "canal": canal,
+            "destino": destino,
+            "assunto": assunto,
+            "mensagem": texto_whatsapp if canal == "whatsapp" else mensagem,
+            "comunicado_id": com.id,
+        }
+        for canal, destino in destinatarios_comunicado(alvo, alvo_id, canais)
+    ]
+    if linhas:
+        db.session.execute(insert(Envio), linhas)
+    com.total = len(linhas)
+    db.session.commit()
+    return com
+
+
+def progresso_comunicado(com):
+    por_status = dict(
+        db.session.execute(
+            select(Envio.status, func.count())
+            .where(Envio.comunicado_id == com.id)
+            .group_by(Envio.status)
+        ).all()
+    )
+    falhas = db.session.scalar(
+        select(func.count()).select_from(EnvioFalho).where(EnvioFalho.comunicado_id == com.id)
+    )
+    pendentes = por_status.get("pendente", 0) + por_status.get("processando", 0)
+    return {
+        "id": com.id,
+        "total": com.total,
+        # os enviados antigos saem da fila (limpar_enviados); o resto fecha a conta
+        "enviados": com.total - pendentes - falhas,
+        "pendentes": pendentes,
+        "falhas": falhas,
+        "concluido": pendentes == 0,
+    }
+
+
+# -------------------------------------------------------------------
+# OPÇÕES PARA <select> (linhas leves, sem objetos ORM)
+# -------------------------------------------------------------------
+def _opcoes(*colunas, order_by):
+    """
+    Executa SELECT só das colunas pedidas e devolve Rows nomeadas
+    (r.id, r.nome...). Não passa pelo identity map nem hidrata o modelo.
+    """
+    return db.session.execute(select(*colunas).order_by(*order_by)).all()
+
+
+def opcoes_alunos():
+    return cache_referencia(
+        "alunos",
+        lambda: _opcoes(Aluno.id, Aluno.nome, order_by=(Aluno.nome.asc(), Aluno.id.asc())),
+    )
+
+
+def opcoes_escolas():
+    return cache_referencia(
+        "escolas", lambda: _opcoes(Escola.id, Escola.nome, order_by=(Escola.nome.asc(),))
+    )
+
+
+def opcoes_series():
+    return cache_referencia(
+        "series", lambda: _opcoes(Serie.id, Serie.nome, order_by=(Serie.nome.asc(),))
+    )
+
+
+def opcoes_horarios():
+    return cache_referencia(
+        "horarios",
+        lambda: _opcoes(
+            Horario.id, Horario.hora_inicio, Horario.hora_fim,
+            order_by=(Horario.hora_inicio.asc(),),
+        ),
+    )
 
 
 # -------------------------------------------------------------------
 # LOGIN / AUTENTICAÃ‡ÃƒO
 # -------------------------------------------------------------------
+def _consulta_snapshot_usuario(uid):
+    return select(
+        Usuario.id, Usuario.email, Usuario.papel, Usuario.ativo, Usuario.aluno_id
+    ).where(Usuario.id == uid)
+
+
+def _snapshot_usuario(uid):
+    # Sempre no primário: o snapshot fica em cache, e uma réplica atrasada
+    # poderia guardar papel/ativo de antes da última alteração.
+    linha = db.session.execute(
+        _consulta_snapshot_usuario(uid), bind_arguments={"bind": db.engine}
+    ).first()
+    return UsuarioSessao(*linha) if linha else None
+
+
+_usuarios_cache = OrderedDict()   # uid -> (versao, expira_em, snapshot), do mais antigo ao mais recente
+_usuarios_lock = threading.Lock()
+
+
 @login_manager.user_loader
 def load_user(uid):
-    return db.session.get(Usuario, int(uid))
+    # O id vem do cookie de sessão assinado do Flask-Login; o snapshot fica
+    # em cache no worker (até USER_CACHE_MAX usuários, pelo TTL) e é
+    # invalidado pela versão "usuarios".
+    uid = int(uid)
+    versao = _versoes_referencia().get("usuarios", 0)
+    agora = time.time()
+    with _usuarios_lock:
+        item = _usuarios_cache.get(uid)
+        if item and item[0] == versao and item[1] > agora:
+            _usuarios_cache.move_to_end(uid)
+            return item[2]
+    snapshot = _snapshot_usuario(uid)
+    with _usuarios_lock:
+        _usuarios_cache[uid] = (versao, agora + app.config["USER_CACHE_TTL"], snapshot)
+        _usuarios_cache.move_to_end(uid)
+        while len(_usuarios_cache) > app.config["USER_CACHE_MAX"]:
+            _usuarios_cache.popitem(last=False)
+    return snapshot
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -384,17 +1509,9 @@ def esqueci():
             session["recuperacao_codigo"] = str(codigo)
             session["recuperacao_modo"] = "email"
 
-            enviado = enviar_codigo_email(email, str(codigo))
-
-            if enviado:
-                flash("Enviamos um código para o seu e-mail.", "success")
-            else:
-                # Fallback: mostra o código na tela (não no terminal)
-                flash(
-                    f"(Modo teste) Não foi possível enviar o e-mail. "
-                    f"Use este código para continuar: {codigo}",
-                    "warning",
-                )
+            # O envio fica com o worker da fila; a requisição não espera o SMTP
+            enfileirar("email", email, texto_codigo_email(codigo), assunto=ASSUNTO_RECUPERACAO)
+            flash("Enviamos um código para o seu e-mail.", "success")
 
             return redirect(url_for("verificar_codigo"))
 
@@ -425,22 +1542,13 @@ def esqueci_whatsapp():
             flash("Informe o nÃºmero de WhatsApp.", "danger")
             return redirect(url_for("esqueci_whatsapp"))
 
-        # Gera cÃ³digo e tenta enviar pelo WhatsApp
+        # Gera código; quem envia é o worker do WhatsApp (navegador já aberto)
         codigo = random.randint(100000, 999999)
         session["recuperacao_codigo"] = str(codigo)
         session["recuperacao_modo"] = "whatsapp"
 
-        enviado = enviar_codigo_whatsapp(numero, codigo)
-
-        if enviado:
-            flash("Um cÃ³digo foi enviado para o WhatsApp informado.", "info")
-        else:
-            # Fallback: mostra o cÃ³digo na tela (nÃ£o no terminal)
-            flash(
-                f"(Modo teste) NÃ£o foi possÃ­vel enviar pelo WhatsApp. "
-                f"Use este cÃ³digo para continuar: {codigo}",
-                "warning",
-            )
+        enfileirar("whatsapp", numero, texto_codigo_whatsapp(codigo))
+        flash("Um cÃ³digo foi enviado para o WhatsApp informado.", "info")
 
         return redirect(url_for("verificar_codigo"))
 
@@ -509,77 +1617,411 @@ def logout():
 # -------------------------------------------------------------------
 # MIGRAÃ‡ÃƒO LEVE / SCHEMA
 # -------------------------------------------------------------------
-def _add_col_if_missing(table: str, column: str, ddl: str):
-    info = db.session.execute(sa_text(f"PRAGMA table_info({table})")).mappings().all()
-    cols = {c["name"] for c in info}
-    if column not in cols:
-        db.session.execute(sa_text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
-        db.session.commit()
+# Aplicadas com `flask db upgrade` (ver migracoes.py); o app não mexe no
+# schema ao subir. Revisões publicadas não se editam: mudança nova = revisão nova.
+migracoes = Migrador()
+
+
+@migracoes.revisao(1, "schema inicial")
+def _rev_0001(conn):
+    db.metadata.create_all(conn)
+
+
+@migracoes.revisao(2, "colunas de versões antigas e índices")
+def _rev_0002(conn):
+    # bancos criados por versões antigas do app, antes destas colunas existirem
+    for tabela, coluna, ddl in (
+        ("atividade", "data", "DATE"),
+        ("atividade", "professor", "TEXT"),
+        ("atividade", "conteudo", "TEXT"),
+        ("atividade", "observacao", "TEXT"),
+        ("horario", "hora_inicio", "TEXT"),
+        ("horario", "hora_fim", "TEXT"),
+        ("escola", "nome", "TEXT"),
+        ("usuario", "aluno_id", "INTEGER"),
+        ("fila_envio", "comunicado_id", "INTEGER"),
+        ("fila_envio_falha", "comunicado_id", "INTEGER"),
+    ):
+        adicionar_coluna(conn, tabela, coluna, ddl)
+    criar_indices(conn, db.metadata)
+
+
+@migracoes.revisao(3, "busca textual de alunos")
+def _rev_0003(conn):
+    # sem FTS5/unaccent o banco segue sem o índice e a busca usa ILIKE
+    conn.exec_driver_sql("SAVEPOINT busca_textual")
+    try:
+        instalar_busca_alunos(conn)
+    except Exception as e:
+        conn.exec_driver_sql("ROLLBACK TO SAVEPOINT busca_textual")
+        print("Busca textual não instalada (usando ILIKE):", e)
+    conn.exec_driver_sql("RELEASE SAVEPOINT busca_textual")
 
 
-def ensure_schema():
-    try:
-        _add_col_if_missing("atividade", "data", "DATE")
-        _add_col_if_missing("atividade", "professor", "TEXT")
-        _add_col_if_missing("atividade", "conteudo", "TEXT")
-        _add_col_if_missing("atividade", "observacao", "TEXT")
-    except Exception:
-        db.session.rollback()
+@migracoes.revisao(4, "staging do import de alunos")
+def _rev_0004(conn):
+    db.metadata.create_all(conn, tables=[AlunoImportacao.__table__])
 
-    try:
-        _add_col_if_missing("horario", "hora_inicio", "TEXT")
-        _add_col_if_missing("horario", "hora_fim", "TEXT")
-    except Exception:
-        db.session.rollback()
 
+# Colunas de models_old.Aluno -> colunas atuais (copiadas só onde a atual está vazia)
+_ALUNO_LEGADO_COPIAS = {
+    "telefone_celular": "telefone_cel",
+    "dificuldade": "tem_dificuldade",
+    "dificuldade_qual": "qual_dificuldade",
+    "medicamento_controlado": "toma_medicamento",
+    "medicamento_qual": "qual_medicamento",
+}
+# texto livre -> (catálogo, chave estrangeira); nomes que não existem são cadastrados
+_ALUNO_LEGADO_CATALOGOS = {"escola": ("escola", "escola_id"), "serie": ("serie", "serie_id")}
+_RE_HORARIO_RESUMO = re.compile(r"(\d{1,2})[:h](\d{2})\s*(?:-|–|a|às)\s*(\d{1,2})[:h](\d{2})")
+
+
+def _colunas_legadas_aluno(conn):
+    legadas = colunas(conn, "aluno") & (
+        set(_ALUNO_LEGADO_COPIAS) | set(_ALUNO_LEGADO_CATALOGOS) | {"horario_resumo"}
+    )
+    return legadas or None
+
+
+@migracoes.backfill(
+    "aluno_legado", tabela="aluno", preparar=_colunas_legadas_aluno,
+    ao_terminar=lambda: invalidar_referencias("escolas", "series", "horarios"),
+)
+def _backfill_aluno_legado(conn, primeiro, ultimo, legadas):
+    """Bancos do cadastro antigo: texto livre/colunas antigas -> modelo atual."""
+    faixa = {"a": primeiro, "b": ultimo}
+
+    copias = [(velha, nova) for velha, nova in _ALUNO_LEGADO_COPIAS.items() if velha in legadas]
+    if copias:
+        conn.execute(sa_text(
+            "UPDATE aluno SET "
+            + ", ".join(f"{nova} = COALESCE({nova}, {velha})" for velha, nova in copias)
+            + " WHERE id BETWEEN :a AND :b AND ("
+            + " OR ".join(f"({nova} IS NULL AND {velha} IS NOT NULL)" for velha, nova in copias)
+            + ")"
+        ), faixa)
+
+    for texto, (catalogo, fk) in _ALUNO_LEGADO_CATALOGOS.items():
+        if texto not in legadas:
+            continue
+        pendente = f"{fk} IS NULL AND TRIM(COALESCE({texto}, '')) <> ''"
+        conn.execute(sa_text(
+            f"INSERT INTO {catalogo} (nome) SELECT DISTINCT TRIM({texto}) FROM aluno "
+            f"WHERE id BETWEEN :a AND :b AND {pendente} AND NOT EXISTS "
+            f"(SELECT 1 FROM {catalogo} c WHERE c.nome = TRIM(aluno.{texto}))"
+        ), faixa)
+        conn.execute(sa_text(
+            f"UPDATE aluno SET {fk} = (SELECT c.id FROM {catalogo} c WHERE c.nome = TRIM(aluno.{texto})) "
+            f"WHERE id BETWEEN :a AND :b AND {pendente}"
+        ), faixa)
+
+    if "horario_resumo" in legadas:
+        linhas = conn.execute(sa_text(
+            "SELECT id, horario_resumo FROM aluno "
+            "WHERE id BETWEEN :a AND :b AND horario_id IS NULL AND horario_resumo IS NOT NULL"
+        ), faixa).all()
+        horarios = {
+            (i, f): id_
+            for id_, i, f in conn.execute(select(Horario.id, Horario.hora_inicio, Horario.hora_fim))
+        }
+        vinculos = []
+        for aluno_id, resumo in linhas:
+            m = _RE_HORARIO_RESUMO.search(resumo)
+            if not m:
+                continue
+            chave = (f"{int(m[1]):02d}:{m[2]}", f"{int(m[3]):02d}:{m[4]}")
+            if chave not in horarios:
+                horarios[chave] = conn.execute(
+                    insert(Horario).values(hora_inicio=chave[0], hora_fim=chave[1])
+                ).inserted_primary_key[0]
+            vinculos.append({"h": horarios[chave], "id": aluno_id})
+        if vinculos:
+            conn.execute(sa_text("UPDATE aluno SET horario_id = :h WHERE id = :id"), vinculos)
+
+
+# -------------------------------------------------------------------
+# BUSCA TEXTUAL DE ALUNOS (FTS5 no SQLite / tsvector no Postgres)
+# -------------------------------------------------------------------
+BUSCA_LIMITE_PADRAO = 20
+BUSCA_LIMITE_MAX = 100
+_CAMPOS_BUSCA = ("nome", "nome_pai", "nome_mae", "bairro", "telefone_cel")
+
+_SQLITE_BUSCA_DDL = [
+    # Tabela externa (content=aluno): o índice não duplica os dados.
+    # remove_diacritics 2 -> "Luís" casa com "luis".
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS aluno_fts USING fts5(
+        {", ".join(_CAMPOS_BUSCA)},
+        content='aluno', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS aluno_fts_ai AFTER INSERT ON aluno BEGIN
+        INSERT INTO aluno_fts(rowid, {", ".join(_CAMPOS_BUSCA)})
+        VALUES (new.id, {", ".join("new." + c for c in _CAMPOS_BUSCA)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS aluno_fts_ad AFTER DELETE ON aluno BEGIN
+        INSERT INTO aluno_fts(aluno_fts, rowid, {", ".join(_CAMPOS_BUSCA)})
+        VALUES ('delete', old.id, {", ".join("old." + c for c in _CAMPOS_BUSCA)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS aluno_fts_au AFTER UPDATE ON aluno BEGIN
+        INSERT INTO aluno_fts(aluno_fts, rowid, {", ".join(_CAMPOS_BUSCA)})
+        VALUES ('delete', old.id, {", ".join("old." + c for c in _CAMPOS_BUSCA)});
+        INSERT INTO aluno_fts(rowid, {", ".join(_CAMPOS_BUSCA)})
+        VALUES (new.id, {", ".join("new." + c for c in _CAMPOS_BUSCA)});
+    END""",
+]
+
+_POSTGRES_BUSCA_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    "ALTER TABLE aluno ADD COLUMN IF NOT EXISTS busca tsvector",
+    """CREATE OR REPLACE FUNCTION aluno_busca_atualiza() RETURNS trigger AS $$
+    BEGIN
+        NEW.busca :=
+            setweight(to_tsvector('simple', unaccent(coalesce(NEW.nome, ''))), 'A') ||
+            setweight(to_tsvector('simple', unaccent(concat_ws(' ',
+                NEW.nome_pai, NEW.nome_mae, NEW.bairro, NEW.telefone_cel))), 'B');
+        RETURN NEW;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS aluno_busca_tg ON aluno",
+    """CREATE TRIGGER aluno_busca_tg BEFORE INSERT OR UPDATE ON aluno
+    FOR EACH ROW EXECUTE FUNCTION aluno_busca_atualiza()""",
+    "CREATE INDEX IF NOT EXISTS ix_aluno_busca ON aluno USING GIN (busca)",
+    # preenche as linhas que já existiam (o trigger recalcula no UPDATE)
+    "UPDATE aluno SET nome = nome WHERE busca IS NULL",
+]
+
+_busca_instalada = None  # cache por processo: None = ainda não verificado
+
+
+def instalar_busca_alunos(conn):
+    """Cria o índice textual e os triggers que o mantêm sincronizado (idempotente)."""
+    dialeto = conn.dialect.name
+    if dialeto == "sqlite":
+        existia = conn.execute(sa_text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='aluno_fts'"
+        )).first() is not None
+        for ddl in _SQLITE_BUSCA_DDL:
+            conn.execute(sa_text(ddl))
+        if not existia:
+            conn.execute(sa_text("INSERT INTO aluno_fts(aluno_fts) VALUES ('rebuild')"))
+    elif dialeto == "postgresql":
+        for ddl in _POSTGRES_BUSCA_DDL:
+            conn.execute(sa_text(ddl))
+
+
+def _tem_busca_textual() -> bool:
+    global _busca_instalada
+    if _busca_instalada is None:
+        dialeto = db.engine.dialect.name
+        if dialeto == "sqlite":
+            sql = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='aluno_fts'"
+        elif dialeto == "postgresql":
+            sql = (
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name='aluno' AND column_name='busca'"
+            )
+        else:
+            return False
+        _busca_instalada = db.session.execute(sa_text(sql)).first() is not None
+    return _busca_instalada
+
+
+_indice_nomes = IndiceTrigramas()
+_indice_nomes_em = None          # quando foi (re)construído; None = nunca
+_indice_nomes_pendentes = None   # alterações feitas durante uma reconstrução
+_indice_nomes_lock = threading.Lock()          # troca do índice / pendentes
+_indice_nomes_construindo = threading.Lock()   # uma construção por vez
+
+
+def indice_nomes():
+    """
+    Índice fuzzy de nomes. A primeira busca do worker o constrói; vencido o
+    TTL, um índice novo é montado numa thread e as buscas seguem no atual
+    até a troca.
+    """
+    if _indice_nomes_em is None:
+        with _indice_nomes_construindo:
+            if _indice_nomes_em is None:
+                _construir_indice_nomes()
+    elif time.time() - _indice_nomes_em > app.config["BUSCA_FUZZY_TTL"]:
+        if _indice_nomes_construindo.acquire(blocking=False):
+            threading.Thread(
+                target=_reconstruir_indice_nomes, name="indice-nomes", daemon=True
+            ).start()
+    return _indice_nomes
+
+
+def _construir_indice_nomes():
+    """Monta um índice novo fora do atual, reaplica o que mudou no meio e troca."""
+    global _indice_nomes, _indice_nomes_em, _indice_nomes_pendentes
+    with _indice_nomes_lock:
+        _indice_nomes_pendentes = []
+    novo = IndiceTrigramas()
     try:
-        _add_col_if_missing("escola", "nome", "TEXT")
+        novo.construir(db.session.execute(select(Aluno.id, Aluno.nome)))
     except Exception:
-        db.session.rollback()
+        with _indice_nomes_lock:
+            _indice_nomes_pendentes = None
+        raise
+    with _indice_nomes_lock:
+        for id_, nome in _indice_nomes_pendentes:
+            if nome is None:
+                novo.remover(id_)
+            else:
+                novo.adicionar(id_, nome)
+        _indice_nomes, _indice_nomes_em, _indice_nomes_pendentes = novo, time.time(), None
 
+
+def _reconstruir_indice_nomes():
+    """Thread da reconstrução pelo TTL (segura _indice_nomes_construindo)."""
     try:
-        _add_col_if_missing("usuario", "aluno_id", "INTEGER")
+        with app.app_context():
+            _construir_indice_nomes()
     except Exception:
-        db.session.rollback()
+        app.logger.exception("Falha ao reconstruir o índice de nomes")
+    finally:
+        _indice_nomes_construindo.release()
+
+
+def _indice_nomes_atualizar(id_, nome=None):
+    """Mantém o índice deste worker em dia após cadastro/edição/exclusão."""
+    if _indice_nomes_em is None:
+        return
+    with _indice_nomes_lock:
+        if _indice_nomes_pendentes is not None:
+            _indice_nomes_pendentes.append((id_, nome))
+        indice = _indice_nomes
+    if nome is None:
+        indice.remover(id_)
+    else:
+        indice.adicionar(id_, nome)
+
+
+def _consulta_busca_alunos(q, limite):
+    """A consulta que buscar_alunos executa (também usada no index-advisor)."""
+    termos = re.findall(r"\w+", q)
+    if not termos:
+        return select(Aluno.id, Aluno.nome).order_by(Aluno.nome.asc()).limit(limite)
+
+    if _tem_busca_textual():
+        dialeto = db.engine.dialect.name
+        if dialeto == "sqlite":
+            match = " ".join('"{}"*'.format(t.replace('"', '""')) for t in termos)
+            return sa_text(
+                "SELECT a.id, a.nome FROM aluno_fts f JOIN aluno a ON a.id = f.rowid "
+                "WHERE aluno_fts MATCH :q "
+                "ORDER BY bm25(aluno_fts, 10.0, 2.0, 2.0, 1.0, 1.0), a.nome "
+                "LIMIT :limite"
+            ).bindparams(q=match, limite=limite)
+        tsq = " & ".join(f"{t}:*" for t in termos)
+        return sa_text(
+            "SELECT id, nome FROM aluno "
+            "WHERE busca @@ to_tsquery('simple', unaccent(:q)) "
+            "ORDER BY ts_rank(busca, to_tsquery('simple', unaccent(:q))) DESC, nome "
+            "LIMIT :limite"
+        ).bindparams(q=tsq, limite=limite)
+
+    stmt = select(Aluno.id, Aluno.nome).where(Aluno.nome.ilike(f"%{q}%"))
+    return stmt.order_by(Aluno.nome.asc()).limit(limite)
+
+
+def buscar_alunos(q: str, limite: int = BUSCA_LIMITE_PADRAO):
+    """
+    Busca por prefixo, sem acento, em nome/pais/bairro/telefone, ordenada por
+    relevância. Sem índice textual instalado, cai no ILIKE em nome.
+    Devolve Rows (id, nome).
+    """
+    return db.session.execute(_consulta_busca_alunos(q, limite)).all()
 
 
 # -------------------------------------------------------------------
 # PERMISSÃ•ES
 # -------------------------------------------------------------------
-def can(permission: str) -> bool:
-    if not current_user.is_authenticated:
-        return False
+# Tabela papel -> permissões. Os nomes em maiúsculas são os usados nos
+# templates; os demais, nas rotas. Permissão fora desta tabela não existe
+# (ver verificar_permissoes_templates).
+PERMISSOES_POR_PAPEL = {
+    "DIRETORIA": {
+        "ver_usuarios", "gerenciar_usuarios", "gerenciar_estrutura",
+        "alunos_crud", "atividades_criar", "atividades_editar", "ver_tudo",
+        "ver_estrutura", "comunicados_enviar",
+        "ALUNO_CRIAR", "ALUNO_EDITAR", "ALUNO_EXCLUIR",
+        "ATIVIDADE_CRIAR", "ATIVIDADE_EDITAR", "ATIVIDADE_EXCLUIR",
+        "SERIE_CRIAR", "SERIE_EDITAR", "SERIE_EXCLUIR",
+    },
+    "PROFESSOR": {"atividades_criar", "ver_tudo", "ver_estrutura", "ATIVIDADE_CRIAR"},
+    "RESPONSAVEL": {"ver_restrito_aluno"},
+    "ALUNO": {"ver_restrito_aluno"},
+}
+# Papéis fora da tabela (o cadastro de usuários aceita qualquer texto): as
+# listagens de escolas/séries/horários sempre barraram só RESPONSAVEL e ALUNO
+PERMISSOES_OUTROS_PAPEIS = {"ver_estrutura"}
+
+# Compilada uma vez: papel -> frozenset, consulta O(1)
+_PERMISSOES = {papel: frozenset(perms) for papel, perms in PERMISSOES_POR_PAPEL.items()}
+_PERMISSOES_OUTROS = frozenset(PERMISSOES_OUTROS_PAPEIS)
+PERMISSOES_CONHECIDAS = frozenset().union(*_PERMISSOES.values(), _PERMISSOES_OUTROS)
+_SEM_PERMISSOES = frozenset()
+
+
+def permissoes_atuais() -> frozenset:
+    # Resolvido uma vez por requisição: os templates chamam can() uma vez por linha
+    if "_permissoes" not in g:
+        if current_user.is_authenticated:
+            g._permissoes = _PERMISSOES.get(current_user.papel_upper(), _PERMISSOES_OUTROS)
+        else:
+            g._permissoes = _SEM_PERMISSOES
+    return g._permissoes
 
-    role = current_user.papel_upper()
 
-    if role == "DIRETORIA":
-        return True
+def can(permission: str) -> bool:
+    return permission in permissoes_atuais()
 
-    if permission == "ver_usuarios":
-        return False
 
-    if permission == "gerenciar_usuarios":
-        return False
+def requer(permissao: str, destino: str = "index", mensagem: str = "Acesso não autorizado."):
+    """Decorator de rota: sem a permissão, avisa e redireciona para `destino`."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not can(permissao):
+                flash(mensagem, "warning")
+                return redirect(url_for(destino))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
 
-    if permission == "gerenciar_estrutura":
-        return role == "DIRETORIA"
 
-    if permission == "alunos_crud":
-        return role == "DIRETORIA"
+_CAN_EM_TEMPLATE = re.compile(r"""\bcan\(\s*['"]([^'"]+)['"]\s*\)""")
 
-    if permission == "atividades_criar":
-        return role in ("DIRETORIA", "PROFESSOR")
 
-    if permission == "atividades_editar":
-        return role == "DIRETORIA"
+def verificar_permissoes_templates():
+    """Falha na inicialização se algum template usa uma permissão desconhecida."""
+    pasta = os.path.join(app.root_path, app.template_folder)
+    desconhecidas = []
+    for raiz, _, arquivos in os.walk(pasta):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            with open(caminho, encoding="utf-8", errors="replace") as f:
+                for permissao in _CAN_EM_TEMPLATE.findall(f.read()):
+                    if permissao not in PERMISSOES_CONHECIDAS:
+                        desconhecidas.append(f"{os.path.relpath(caminho, pasta)}: {permissao}")
+    if desconhecidas:
+        raise RuntimeError("Permissões desconhecidas nos templates: " + ", ".join(desconhecidas))
 
-    if permission == "ver_tudo":
-        return role in ("DIRETORIA", "PROFESSOR")
 
-    if permission == "ver_restrito_aluno":
-        return role in ("RESPONSAVEL", "ALUNO")
+@app.after_request
+def _log_consultas(resp):
+    # LOG_CONSULTAS=1: registra quantos comandos SQL cada requisição executou
+    if app.config["LOG_CONSULTAS"]:
+        app.logger.info("%s %s -> %d consultas", request.method, request.path, g.get("n_consultas", 0))
+    return resp
 
-    return False
+
+@app.before_request
+def _marcar_escrita_recente():
+    # read-your-writes: após um POST, as próximas leituras deste usuário
+    # ficam no primário até a réplica alcançar
+    if request.method not in ("GET", "HEAD", "OPTIONS") and app.config.get("SQLALCHEMY_BINDS"):
+        session["_ler_primario_ate"] = time.time() + app.config["REPLICA_STICKY_SEGUNDOS"]
 
 
 @app.context_processor
@@ -601,23 +2043,21 @@ def index():
 # -------------------------------------------------------------------
 @app.route("/usuarios/", methods=["GET"])
 @login_required
+@requer("gerenciar_usuarios", mensagem="Acesso restrito Ã  DIRETORIA.")
 def usuarios_list():
-    if not current_user.is_diretoria():
-        flash("Acesso restrito Ã  DIRETORIA.", "warning")
-        return redirect(url_for("index"))
-
-    items = Usuario.query.order_by(Usuario.email.asc()).all()
-    alunos = Aluno.query.order_by(Aluno.nome.asc()).all()
+    items = (
+        Usuario.query.options(selectinload(Usuario.aluno).load_only(Aluno.id, Aluno.nome))
+        .order_by(Usuario.email.asc())
+        .all()
+    )
+    alunos = opcoes_alunos()
     return render_template("usuarios/listar.html", items=items, alunos=alunos)
 
 
 @app.route("/usuarios/novo", methods=["POST"])
 @login_required
+@requer("gerenciar_usuarios", mensagem="Acesso restrito Ã  DIRETORIA.")
 def usuarios_novo():
-    if not current_user.is_diretoria():
-        flash("Acesso restrito Ã  DIRETORIA.", "warning")
-        return redirect(url_for("index"))
-
     email = request.form.get("email", "").strip().lower()
     senha = request.form.get("senha", "")
     senha2 = request.form.get("senha2", "")
@@ -658,11 +2098,8 @@ def usuarios_novo():
 
 @app.route("/usuarios/<int:id>/editar", methods=["POST"])
 @login_required
+@requer("gerenciar_usuarios", mensagem="Acesso restrito Ã  DIRETORIA.")
 def usuarios_editar(id):
-    if not current_user.is_diretoria():
-        flash("Acesso restrito Ã  DIRETORIA.", "warning")
-        return redirect(url_for("index"))
-
     u = Usuario.query.get_or_404(id)
     papel = (request.form.get("papel", u.papel) or u.papel).upper()
     ativo = True if request.form.get("ativo") == "on" else False
@@ -684,22 +2121,22 @@ def usuarios_editar(id):
     u.aluno_id = int(aluno_id) if aluno_id else None
 
     db.session.commit()
+    invalidar_referencias("usuarios")
     flash("UsuÃ¡rio atualizado.", "success")
     return redirect(url_for("usuarios_list"))
 
 
 @app.route("/usuarios/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("gerenciar_usuarios", mensagem="Acesso restrito Ã  DIRETORIA.")
 def usuarios_excluir(id):
-    if not current_user.is_diretoria():
-        flash("Acesso restrito Ã  DIRETORIA.", "warning")
-        return redirect(url_for("index"))
     if current_user.id == id:
         flash("VocÃª nÃ£o pode excluir a si mesmo.", "warning")
         return redirect(url_for("usuarios_list"))
     u = Usuario.query.get_or_404(id)
     db.session.delete(u)
     db.session.commit()
+    invalidar_referencias("usuarios")
     flash("UsuÃ¡rio removido.", "success")
     return redirect(url_for("usuarios_list"))
 
@@ -708,24 +2145,24 @@ def usuarios_excluir(id):
 # -------------------------------------------------------------------
 @app.route("/professores/")
 @login_required
+@requer("gerenciar_estrutura", mensagem="VocÃª nÃ£o tem permissÃ£o para acessar Professores.")
 def professores_listar():
-    if not current_user.is_diretoria():
-        flash("VocÃª nÃ£o tem permissÃ£o para acessar Professores.", "warning")
-        return redirect(url_for("index"))
-
-    itens = Professor.query.order_by(Professor.nome.asc()).all()
+    itens = _consulta_professores().all()
     return render_template("professores/listar.html", itens=itens)
 
 
+def _consulta_professores():
+    return Professor.query.options(
+        joinedload(Professor.usuario).load_only(Usuario.id, Usuario.email),
+        selectinload(Professor.series),
+    ).order_by(Professor.nome.asc())
+
+
 @app.route("/professores/novo", methods=["GET", "POST"])
 @login_required
+@requer("gerenciar_estrutura", mensagem="VocÃª nÃ£o tem permissÃ£o para cadastrar Professores.")
 def professores_novo():
-    if not current_user.is_diretoria():
-        flash("VocÃª nÃ£o tem permissÃ£o para cadastrar Professores.", "warning")
-        return redirect(url_for("index"))
-
-    usuarios = Usuario.query.order_by(Usuario.email.asc()).all()
-    series = Serie.query.order_by(Serie.nome.asc()).all()
+    series = opcoes_series()
 
     if request.method == "POST":
         email = (request.form.get("email") or "").strip().lower()
@@ -778,23 +2215,24 @@ def professores_novo():
         u.papel = "PROFESSOR"
 
         db.session.commit()
+        invalidar_referencias("usuarios")
         flash("Professor cadastrado com sucesso.", "success")
         return redirect(url_for("professores_listar"))
 
-    return render_template("professores/form.html", usuarios=usuarios, series=series, item=None)
+    return render_template("professores/form.html", series=series, item=None)
 
 
 @app.route("/professores/<int:id>/editar", methods=["GET", "POST"])
 @login_required
+@requer("gerenciar_estrutura", mensagem="VocÃª nÃ£o tem permissÃ£o para editar Professores.")
 def professores_editar(id):
-    if not current_user.is_diretoria():
-        flash("VocÃª nÃ£o tem permissÃ£o para editar Professores.", "warning")
-        return redirect(url_for("index"))
-
-    prof = Professor.query.get_or_404(id)
+    prof = db.get_or_404(
+        Professor,
+        id,
+        options=[joinedload(Professor.usuario), selectinload(Professor.series)],
+    )
 
-    usuarios = Usuario.query.order_by(Usuario.email.asc()).all()
-    series = Serie.query.order_by(Serie.nome.asc()).all()
+    series = opcoes_series()
 
     if request.method == "POST":
         email = (request.form.get("email") or "").strip().lower()
@@ -842,32 +2280,27 @@ def professores_editar(id):
         u.papel = "PROFESSOR"
 
         db.session.commit()
+        invalidar_referencias("usuarios")
         flash("Professor atualizado com sucesso.", "success")
         return redirect(url_for("professores_listar"))
 
-    return render_template("professores/form.html", usuarios=usuarios, series=series, item=prof)
+    return render_template("professores/form.html", series=series, item=prof)
 
 # -------------------------------------------------------------------
 # ESCOLAS
 # -------------------------------------------------------------------
 @app.route("/escolas/")
 @login_required
+@requer("ver_estrutura")
 def escolas_list():
-    if current_user.is_responsavel() or current_user.is_aluno():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     items = Escola.query.order_by(Escola.nome.asc()).all()
     return render_template("escolas/listar.html", items=items)
 
 
 @app.route("/escolas/novo", methods=["GET", "POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def escolas_nova():
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     if request.method == "POST":
         nome = request.form.get("nome", "").strip()
         if not nome:
@@ -879,6 +2312,7 @@ def escolas_nova():
         e = Escola(nome=nome)
         db.session.add(e)
         db.session.commit()
+        invalidar_referencias("escolas")
         flash("Escola cadastrada.", "success")
         return redirect(url_for("escolas_list"))
     return render_template("escolas/form.html")
@@ -886,11 +2320,8 @@ def escolas_nova():
 
 @app.route("/escolas/<int:id>/editar", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def escolas_editar(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     e = Escola.query.get_or_404(id)
     nome = request.form.get("nome", "").strip()
     if not nome:
@@ -901,20 +2332,19 @@ def escolas_editar(id):
         return redirect(url_for("escolas_list"))
     e.nome = nome
     db.session.commit()
+    invalidar_referencias("escolas")
     flash("Escola atualizada.", "success")
     return redirect(url_for("escolas_list"))
 
 
 @app.route("/escolas/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def escolas_excluir(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     e = Escola.query.get_or_404(id)
     db.session.delete(e)
     db.session.commit()
+    invalidar_referencias("escolas")
     flash("Escola excluÃ­da.", "success")
     return redirect(url_for("escolas_list"))
 
@@ -924,22 +2354,16 @@ def escolas_excluir(id):
 # -------------------------------------------------------------------
 @app.route("/series/")
 @login_required
+@requer("ver_estrutura")
 def series_list():
-    if current_user.is_responsavel() or current_user.is_aluno():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     series = Serie.query.order_by(Serie.nome.asc()).all()
     return render_template("series/listar.html", series=series)
 
 
 @app.route("/series/novo", methods=["GET", "POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def series_nova():
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     if request.method == "POST":
         nome = request.form.get("nome", "").strip()
         if not nome:
@@ -951,6 +2375,7 @@ def series_nova():
         s = Serie(nome=nome)
         db.session.add(s)
         db.session.commit()
+        invalidar_referencias("series")
         flash("SÃ©rie cadastrada.", "success")
         return redirect(url_for("series_list"))
     return render_template("series/form.html")
@@ -958,11 +2383,8 @@ def series_nova():
 
 @app.route("/series/<int:id>/editar", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def series_editar(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     s = Serie.query.get_or_404(id)
     nome = request.form.get("nome", "").strip()
     if not nome:
@@ -973,20 +2395,19 @@ def series_editar(id):
         return redirect(url_for("series_list"))
     s.nome = nome
     db.session.commit()
+    invalidar_referencias("series")
     flash("SÃ©rie atualizada.", "success")
     return redirect(url_for("series_list"))
 
 
 @app.route("/series/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def series_excluir(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     s = Serie.query.get_or_404(id)
     db.session.delete(s)
     db.session.commit()
+    invalidar_referencias("series")
     flash("SÃ©rie excluÃ­da.", "success")
     return redirect(url_for("series_list"))
 
@@ -996,15 +2417,12 @@ def series_excluir(id):
 # -------------------------------------------------------------------
 @app.route("/horarios/")
 @login_required
+@requer("ver_estrutura")
 def horarios_list():
-    if current_user.is_responsavel() or current_user.is_aluno():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
-    items = Horario.query.order_by(Horario.hora_inicio.asc()).all()
+    items = _consulta_horarios().all()
 
     # âœ… Alunos agrupados por horÃ¡rio
-    alunos = Aluno.query.order_by(Aluno.nome.asc()).all()
+    alunos = _consulta_alunos_por_horario().all()
 
     alunos_por_horario = {}
     alunos_sem_horario = []
@@ -1024,13 +2442,22 @@ def horarios_list():
 
 
 
+def _consulta_horarios():
+    return Horario.query.order_by(Horario.hora_inicio.asc())
+
+
+def _consulta_alunos_por_horario():
+    return Aluno.query.options(
+        load_only(Aluno.id, Aluno.nome, Aluno.horario_id),
+        joinedload(Aluno.escola),
+        joinedload(Aluno.serie),
+    ).order_by(Aluno.nome.asc())
+
+
 @app.route("/horarios/novo", methods=["GET", "POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def horarios_novo():
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     if request.method == "POST":
         h_ini = request.form.get("hora_inicio", "").strip()
         h_fim = request.form.get("hora_fim", "").strip()
@@ -1043,6 +2470,7 @@ def horarios_novo():
         h = Horario(hora_inicio=h_ini, hora_fim=h_fim)
         db.session.add(h)
         db.session.commit()
+        invalidar_referencias("horarios")
         flash("HorÃ¡rio cadastrado.", "success")
         return redirect(url_for("horarios_list"))
     return render_template("horarios/form.html")
@@ -1053,11 +2481,8 @@ app.add_url_rule("/horarios/novo", endpoint="horarios_new", view_func=horarios_n
 
 @app.route("/horarios/<int:id>/editar", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def horarios_editar(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     h = Horario.query.get_or_404(id)
     h_ini = request.form.get("hora_inicio", "").strip()
     h_fim = request.form.get("hora_fim", "").strip()
@@ -1067,20 +2492,19 @@ def horarios_editar(id):
     h.hora_inicio = h_ini
     h.hora_fim = h_fim
     db.session.commit()
+    invalidar_referencias("horarios")
     flash("HorÃ¡rio atualizado.", "success")
     return redirect(url_for("horarios_list"))
 
 
 @app.route("/horarios/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("gerenciar_estrutura")
 def horarios_excluir(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("index"))
-
     h = Horario.query.get_or_404(id)
     db.session.delete(h)
     db.session.commit()
+    invalidar_referencias("horarios")
     flash("HorÃ¡rio excluÃ­do.", "success")
     return redirect(url_for("horarios_list"))
 
@@ -1091,17 +2515,57 @@ def horarios_excluir(id):
 @app.route("/alunos/")
 @login_required
 def alunos_list():
-    items = Aluno.query.order_by(Aluno.nome.asc()).all()
-    return render_template("alunos/listar.html", items=items)
+    """
+    Lista paginada por keyset em (nome, id): ?apos=<cursor>&por_pagina=N.
+    Com ?stream=1 a página é renderizada em streaming, buscando as linhas
+    do banco em lotes (yield_per) à medida que o HTML é enviado.
+    """
+    por_pagina = _tamanho_pagina(
+        request.args.get("por_pagina"), app.config["ALUNOS_POR_PAGINA"]
+    )
+    cursor = _decodificar_cursor(request.args.get("apos"), str, int)
+    streaming = request.args.get("stream") == "1"
+
+    query = _consulta_alunos(cursor)
+
+    if streaming:
+        # Sem limite: percorre do cursor até o fim, sem materializar a lista
+        items = query.yield_per(por_pagina)
+        return stream_template(
+            "alunos/listar.html",
+            items=items,
+            proximo=None,
+            cursor=cursor,
+            por_pagina=por_pagina,
+        )
+
+    items = query.limit(por_pagina + 1).all()
+    proximo = None
+    if len(items) > por_pagina:
+        items = items[:por_pagina]
+        proximo = _codificar_cursor(items[-1].nome, items[-1].id)
+
+    return render_template(
+        "alunos/listar.html",
+        items=items,
+        proximo=proximo,
+        cursor=cursor,
+        por_pagina=por_pagina,
+    )
+
+
+def _consulta_alunos(cursor=None):
+    """Alunos em ordem (nome, id), a partir do cursor (nome, id) se houver."""
+    query = Aluno.query.options(*ALUNO_COM_REFERENCIAS)
+    if cursor:
+        query = query.filter(tuple_(Aluno.nome, Aluno.id) > tuple(cursor))
+    return query.order_by(Aluno.nome.asc(), Aluno.id.asc())
 
 
 @app.route("/alunos/novo", methods=["GET", "POST"])
 @login_required
+@requer("alunos_crud", "alunos_list")
 def alunos_novo():
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("alunos_list"))
-
     if request.method == "POST":
         nome = request.form.get("nome", "").strip()
         escola_id = request.form.get("escola_id")
@@ -1112,9 +2576,6 @@ def alunos_novo():
         telefone_fixo = request.form.get("telefone_fixo")
         observacoes = request.form.get("observacoes")
 
-        file = request.files.get("foto")
-        foto_path = salvar_foto(file)
-
         naturalidade = request.form.get("naturalidade")
         nacionalidade = request.form.get("nacionalidade")
         data_nasc = request.form.get("data_nascimento")
@@ -1140,7 +2601,6 @@ def alunos_novo():
             telefone_cel=telefone_cel,
             telefone_fixo=telefone_fixo,
             observacoes=observacoes,
-            foto_path=foto_path,
             naturalidade=naturalidade,
             nacionalidade=nacionalidade,
             data_nascimento=datetime.strptime(data_nasc, "%Y-%m-%d").date()
@@ -1162,14 +2622,19 @@ def alunos_novo():
             else None,
             mensalidade_opcao=mensalidade_opcao,
         )
+        # por último: formulário inválido (datas/números acima) não grava foto
+        sha_foto = preparar_foto(request.files.get("foto"))
+        a.foto_path = registrar_foto(sha_foto)
         db.session.add(a)
         db.session.commit()
+        invalidar_referencias("alunos")
+        _indice_nomes_atualizar(a.id, a.nome)
         flash("Aluno cadastrado.", "success")
         return redirect(url_for("alunos_list"))
 
-    escolas = Escola.query.order_by(Escola.nome.asc()).all()
-    series = Serie.query.order_by(Serie.nome.asc()).all()
-    horarios = Horario.query.order_by(Horario.hora_inicio.asc()).all()
+    escolas = opcoes_escolas()
+    series = opcoes_series()
+    horarios = opcoes_horarios()
     return render_template(
         "alunos/form.html", escolas=escolas, series=series, horarios=horarios
     )
@@ -1180,11 +2645,8 @@ app.add_url_rule("/alunos/novo", endpoint="alunos_new", view_func=alunos_novo)
 
 @app.route("/alunos/<int:id>/editar", methods=["GET", "POST"])
 @login_required
+@requer("alunos_crud", "alunos_list")
 def alunos_editar(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("alunos_list"))
-
     a = Aluno.query.get_or_404(id)
     if request.method == "POST":
         a.nome = request.form.get("nome", a.nome).strip()
@@ -1203,9 +2665,6 @@ def alunos_editar(id):
         a.telefone_fixo = request.form.get("telefone_fixo")
         a.observacoes = request.form.get("observacoes")
 
-        file = request.files.get("foto")
-        a.foto_path = salvar_foto(file, foto_atual=a.foto_path)
-
         a.naturalidade = request.form.get("naturalidade")
         a.nacionalidade = request.form.get("nacionalidade")
         data_nasc = request.form.get("data_nascimento")
@@ -1235,14 +2694,20 @@ def alunos_editar(id):
             else None
         )
         a.mensalidade_opcao = request.form.get("mensalidade_opcao")
+        # por último: aluno inexistente (404) ou formulário inválido não gravam foto
+        sha_foto = preparar_foto(request.files.get("foto"))
+        a.foto_path = registrar_foto(sha_foto, foto_atual=a.foto_path)
 
         db.session.commit()
+        coletar_fotos_orfas()
+        invalidar_referencias("alunos")
+        _indice_nomes_atualizar(a.id, a.nome)
         flash("Aluno atualizado.", "success")
         return redirect(url_for("alunos_list"))
 
-    escolas = Escola.query.order_by(Escola.nome.asc()).all()
-    series = Serie.query.order_by(Serie.nome.asc()).all()
-    horarios = Horario.query.order_by(Horario.hora_inicio.asc()).all()
+    escolas = opcoes_escolas()
+    series = opcoes_series()
+    horarios = opcoes_horarios()
     return render_template(
         "alunos/form.html",
         aluno=a,
@@ -1254,14 +2719,15 @@ def alunos_editar(id):
 
 @app.route("/alunos/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("alunos_crud", "alunos_list")
 def alunos_excluir(id):
-    if not current_user.is_diretoria():
-        flash("Acesso nÃ£o autorizado.", "warning")
-        return redirect(url_for("alunos_list"))
-
     a = Aluno.query.get_or_404(id)
+    liberar_foto(a.foto_path)
     db.session.delete(a)
     db.session.commit()
+    coletar_fotos_orfas()
+    invalidar_referencias("alunos")
+    _indice_nomes_atualizar(id)
     flash("Aluno excluÃ­do.", "success")
     return redirect(url_for("alunos_list"))
 
@@ -1269,7 +2735,7 @@ def alunos_excluir(id):
 @app.route("/alunos/<int:id>")
 @login_required
 def alunos_ver(id):
-    a = Aluno.query.get_or_404(id)
+    a = db.get_or_404(Aluno, id, options=list(ALUNO_COM_REFERENCIAS))
 
     if current_user.is_diretoria() or current_user.is_professor():
         pass
@@ -1285,36 +2751,336 @@ def alunos_ver(id):
 @login_required
 def alunos_search():
     q = request.args.get("q", "").strip()
-    query = Aluno.query
-    if q:
-        like = f"%{q}%"
-        query = query.filter(Aluno.nome.ilike(like))
-    alunos = query.order_by(Aluno.nome.asc()).all()
+    limite = request.args.get("limit", BUSCA_LIMITE_PADRAO, type=int)
+    limite = max(1, min(limite, BUSCA_LIMITE_MAX))
+    if request.args.get("fuzzy") == "1":
+        achados = indice_nomes().buscar(q, limite) if q else []
+        return jsonify([{"id": i, "nome": n, "score": sc} for i, n, sc in achados])
+    alunos = buscar_alunos(q, limite)
     return jsonify([{"id": a.id, "nome": a.nome} for a in alunos])
 
 
+# -------------------------------------------------------------------
+# IMPORTAÇÃO DE ALUNOS POR PLANILHA
+# -------------------------------------------------------------------
+_CONVERSOES_IMPORTACAO = {
+    "data_nascimento": data,
+    "inicio_aulas": data,
+    "idade": inteiro,
+    "tem_dificuldade": booleano,
+    "toma_medicamento": booleano,
+}
+_RE_HORA = re.compile(r"^(\d{1,2})[:h](\d{2})$")
+
+
+def _dicionarios_importacao():
+    """Nome normalizado -> id de escolas/séries e (início, fim) -> id de horários."""
+    horarios = {(h.hora_inicio, h.hora_fim): h.id for h in opcoes_horarios()}
+    inicios = {}
+    for (inicio, _), id_ in horarios.items():
+        inicios[inicio] = None if inicio in inicios else id_   # só vale se for único
+    return {
+        "escola": {normalizar(e.nome): e.id for e in opcoes_escolas()},
+        "serie": {normalizar(s.nome): s.id for s in opcoes_series()},
+        "horario": horarios,
+        "horario_inicio": inicios,
+    }
+
+
+def _resolver_horario(valor, dicionarios):
+    valor = str(valor).strip()
+    m = _RE_HORARIO_RESUMO.search(valor)
+    if m:
+        id_ = dicionarios["horario"].get((f"{int(m[1]):02d}:{m[2]}", f"{int(m[3]):02d}:{m[4]}"))
+    else:
+        m = _RE_HORA.match(valor)
+        id_ = dicionarios["horario_inicio"].get(f"{int(m[1]):02d}:{m[2]}") if m else None
+    if id_ is None:
+        raise ValueError(f"'{valor}' não cadastrado")
+    return id_
+
+
+def _converter_linha_importacao(dados, dicionarios):
+    """{campo: valor da planilha} -> (registro para o staging, erro ou None)."""
+    registro, erros = dict.fromkeys(CAMPOS_IMPORTACAO), []
+    for campo, valor in dados.items():
+        try:
+            if campo == "horario":
+                registro["horario_id"] = _resolver_horario(valor, dicionarios)
+            elif campo in ("escola", "serie"):
+                id_ = dicionarios[campo].get(normalizar(valor))
+                if id_ is None:
+                    raise ValueError(f"'{texto(valor)}' não cadastrada")
+                registro[f"{campo}_id"] = id_
+            elif campo in _CONVERSOES_IMPORTACAO:
+                registro[campo] = _CONVERSOES_IMPORTACAO[campo](valor)
+            else:
+                registro[campo] = texto(valor, Aluno.__table__.c[campo].type.length)
+        except ValueError as e:
+            erros.append(f"{campo}: {e}")
+    if registro["sexo"]:
+        registro["sexo"] = registro["sexo"][:1].upper()
+    if not registro["nome"]:
+        erros.append("nome: obrigatório")
+    return registro, "; ".join(erros) or None
+
+
+def _validar_importacao(lote):
+    """Validações que precisam do banco, feitas em SQL sobre o lote inteiro."""
+    st = AlunoImportacao
+    pendentes = (st.lote == lote, st.erro.is_(None))
+    sem_sync = {"synchronize_session": False}
+    db.session.execute(
+        update(st)
+        .where(*pendentes, exists().where(
+            Aluno.nome == st.nome,
+            Aluno.data_nascimento.is_not_distinct_from(st.data_nascimento),
+        ))
+        .values(erro="aluno já cadastrado (mesmo nome e data de nascimento)"),
+        execution_options=sem_sync,
+    )
+    anterior = aliased(st)
+    db.session.execute(
+        update(st)
+        .where(*pendentes, exists().where(
+            anterior.lote == lote,
+            anterior.linha < st.linha,
+            anterior.nome == st.nome,
+            anterior.data_nascimento.is_not_distinct_from(st.data_nascimento),
+        ))
+        .values(erro="repetido na planilha (mesmo nome e data de nascimento)"),
+        execution_options=sem_sync,
+    )
+    # célula vazia = "não", como o checkbox desmarcado do formulário
+    for coluna in (st.tem_dificuldade, st.toma_medicamento):
+        db.session.execute(
+            update(st).where(st.lote == lote, coluna.is_(None)).values({coluna: False}),
+            execution_options=sem_sync,
+        )
+
+
+def importar_alunos(caminho, tipo, simular=False):
+    """
+    Import em massa: a planilha é lida em streaming, cada linha convertida
+    (nomes de escola/série/horário -> id por dicionário em memória) e
+    gravada no staging aluno_importacao em lotes de IMPORTACAO_LOTE com
+    executemany. Duplicados são marcados em SQL e as linhas válidas vão
+    para aluno num INSERT ... SELECT só. Com simular=True nada é gravado.
+
+    Devolve {"total", "importados", "erros": [(linha, mensagem)], "ignoradas"}.
+    Levanta PlanilhaInvalida se o arquivo/cabeçalho não puder ser lido.
+    """
+    global _indice_nomes_em
+    ignoradas, linhas = ler_planilha(caminho, tipo)
+    st = AlunoImportacao
+    lote = uuid.uuid4().hex
+    # lotes de imports interrompidos
+    db.session.execute(delete(st).where(st.criado_em < datetime.utcnow() - timedelta(days=1)))
+    db.session.commit()
+
+    dicionarios = _dicionarios_importacao()
+    agora = datetime.utcnow()
+    total, pendentes = 0, []
+    try:
+        for numero, dados in linhas:
+            registro, erro = _converter_linha_importacao(dados, dicionarios)
+            registro.update(lote=lote, linha=numero, erro=erro, criado_em=agora)
+            pendentes.append(registro)
+            total += 1
+            if len(pendentes) >= app.config["IMPORTACAO_LOTE"]:
+                db.session.execute(insert(st), pendentes)
+                db.session.commit()
+                pendentes = []
+        if pendentes:
+            db.session.execute(insert(st), pendentes)
+
+        _validar_importacao(lote)
+        validas = (st.lote == lote, st.erro.is_(None))
+        importados = 0 if simular else db.session.scalar(select(func.count()).where(*validas))
+        if importados:
+            db.session.execute(insert(Aluno.__table__).from_select(
+                CAMPOS_IMPORTACAO,
+                select(*[st.__table__.c[c] for c in CAMPOS_IMPORTACAO]).where(*validas).order_by(st.linha),
+            ))
+        erros = [tuple(e) for e in db.session.execute(
+            select(st.linha, st.erro).where(st.lote == lote, st.erro.is_not(None)).order_by(st.linha)
+        )]
+        db.session.execute(delete(st).where(st.lote == lote))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        try:
+            db.session.execute(delete(st).where(st.lote == lote))
+            db.session.commit()
+        except Exception:
+            # não esconde o erro original; a limpeza diária do staging recolhe o lote
+            db.session.rollback()
+            app.logger.exception("Staging do lote %s não foi limpo", lote)
+        raise
+
+    if importados:
+        invalidar_referencias("alunos")
+        if _indice_nomes_em is not None:
+            _indice_nomes_em = 0.0  # vence o índice fuzzy: reconstrói na próxima busca
+    return {"total": total, "importados": importados, "erros": erros, "ignoradas": ignoradas}
+
+
+@app.route("/alunos/importar", methods=["GET", "POST"])
+@login_required
+@requer("alunos_crud", "alunos_list")
+def alunos_importar():
+    resultado = None
+    if request.method == "POST":
+        arquivo = request.files.get("arquivo")
+        recebido = getattr(arquivo, "stream", None)
+        if not arquivo or not arquivo.filename:
+            flash("Escolha um arquivo .csv ou .xlsx.", "warning")
+        elif (not isinstance(recebido, ArquivoRecebido) or recebido.rejeitado == "tipo"
+              or (recebido.caminho and recebido.formato is None)):
+            flash("Formato não reconhecido: envie um .csv ou .xlsx.", "warning")
+        elif recebido.rejeitado == "tamanho":
+            flash(f"Planilha maior que {_limite_mb('IMPORTACAO_MAX_BYTES')}.", "warning")
+        elif recebido.caminho is None:
+            flash("Arquivo vazio.", "warning")
+        else:
+            simular = request.form.get("simular") == "on"
+            recebido.seek(0)   # garante o conteúdo em disco antes de reabrir pelo caminho
+            try:
+                resultado = importar_alunos(recebido.caminho, recebido.formato, simular=simular)
+            except PlanilhaInvalida as e:
+                flash(f"Não foi possível ler a planilha: {e}.", "danger")
+            else:
+                resultado["simulacao"] = simular
+                if simular:
+                    flash(f"Simulação: {resultado['total'] - len(resultado['erros'])} de "
+                          f"{resultado['total']} linhas seriam importadas.", "info")
+                else:
+                    flash(f"{resultado['importados']} alunos importados.", "success")
+    return render_template("alunos/importar.html", resultado=resultado)
+
+
+@app.cli.command("alunos-importar")
+@click.argument("arquivo", type=click.Path(exists=True, dir_okay=False))
+@click.option("--simular", is_flag=True, help="Só valida; não grava alunos.")
+@click.option("--relatorio", type=click.Path(dir_okay=False), help="Grava as linhas com erro neste CSV.")
+def alunos_importar_cmd(arquivo, simular, relatorio):
+    """Importa alunos de uma planilha .csv ou .xlsx."""
+    with open(arquivo, "rb") as f:
+        tipo = tipo_planilha(f.read(TAMANHO_CABECALHO))
+    if tipo is None:
+        raise click.ClickException("formato não reconhecido: use .csv ou .xlsx")
+    t0 = time.monotonic()
+    try:
+        r = importar_alunos(arquivo, tipo, simular=simular)
+    except PlanilhaInvalida as e:
+        raise click.ClickException(str(e))
+    if r["ignoradas"]:
+        click.echo("Colunas ignoradas: " + ", ".join(r["ignoradas"]))
+    verbo = "seriam importadas" if simular else "importadas"
+    click.echo(f"{r['total']} linhas lidas, {r['total'] - len(r['erros']) if simular else r['importados']} "
+               f"{verbo}, {len(r['erros'])} com erro ({time.monotonic() - t0:.1f} s).")
+    for linha, erro in r["erros"][:20]:
+        click.echo(f"  linha {linha}: {erro}")
+    if len(r["erros"]) > 20:
+        click.echo(f"  ... mais {len(r['erros']) - 20}")
+    if relatorio and r["erros"]:
+        with open(relatorio, "w", newline="", encoding="utf-8-sig") as f:
+            escritor = csv.writer(f, delimiter=";")
+            escritor.writerow(["linha", "erro"])
+            escritor.writerows(r["erros"])
+        click.echo(f"Relatório de erros: {relatorio}")
+
+
 # -------------------------------------------------------------------
 # ATIVIDADES
 # -------------------------------------------------------------------
+def _consulta_atividades(aluno_id=None, professor="", de=None, ate=None, cursor=None):
+    """Feed de atividades em ordem (data desc, id desc) com os filtros da listagem."""
+    query = Atividade.query.options(
+        joinedload(Atividade.aluno).load_only(Aluno.id, Aluno.nome)
+    )
+    if aluno_id:
+        query = query.filter(Atividade.aluno_id == aluno_id)
+    if professor:
+        query = query.filter(Atividade.professor.ilike(f"%{professor}%"))
+    if de:
+        query = query.filter(Atividade.data >= de)
+    if ate:
+        query = query.filter(Atividade.data <= ate)
+    if cursor:
+        query = query.filter(tuple_(Atividade.data, Atividade.id) < tuple(cursor))
+    return query.order_by(Atividade.data.desc(), Atividade.id.desc())
+
+
 @app.route("/atividades/")
 @login_required
 def atividades_listar():
-    if current_user.is_diretoria() or current_user.is_professor():
-        itens = Atividade.query.order_by(
-            Atividade.data.desc(), Atividade.id.desc()
-        ).all()
-    else:
-        if not current_user.aluno_id:
-            itens = []
-        else:
-            itens = (
-                Atividade.query.filter_by(aluno_id=current_user.aluno_id)
-                .order_by(Atividade.data.desc(), Atividade.id.desc())
-                .all()
+    """
+    Feed paginado por keyset em (data desc, id desc): ?apos=<cursor>&por_pagina=N.
+    Filtros aplicados no SQL: ?aluno_id=, ?professor=, ?de=YYYY-MM-DD, ?ate=YYYY-MM-DD.
+    O seletor de aluno usa o autocomplete de /alunos/search.
+    """
+    por_pagina = _tamanho_pagina(
+        request.args.get("por_pagina"), app.config["ATIVIDADES_POR_PAGINA"]
+    )
+    cursor = _decodificar_cursor(request.args.get("apos"), str, int)
+    cur_data = _parse_data(cursor[0]) if cursor else None
+    if cur_data is None:
+        cursor = None   # data que não é ISO: recomeça do início
+
+    aluno_id = request.args.get("aluno_id", type=int)
+    professor = request.args.get("professor", "").strip()
+    de = _parse_data(request.args.get("de"))
+    ate = _parse_data(request.args.get("ate"))
+
+    ver_tudo = current_user.is_diretoria() or current_user.is_professor()
+    if not ver_tudo:
+        # ALUNO/RESPONSAVEL só veem as atividades do aluno vinculado
+        aluno_id = current_user.aluno_id
+        if not aluno_id:
+            return render_template(
+                "atividades/listar.html",
+                atividades=[],
+                filtros={},
+                aluno_filtro=None,
+                proximo=None,
+                cursor=None,
+                por_pagina=por_pagina,
             )
 
-    alunos = Aluno.query.order_by(Aluno.nome.asc()).all()
-    return render_template("atividades/listar.html", atividades=itens, alunos=alunos)
+    query = _consulta_atividades(
+        aluno_id, professor, de, ate, (cur_data, cursor[1]) if cursor else None
+    )
+    itens = query.limit(por_pagina + 1).all()
+    proximo = None
+    if len(itens) > por_pagina:
+        itens = itens[:por_pagina]
+        proximo = _codificar_cursor(itens[-1].data, itens[-1].id)
+
+    filtros = {
+        k: v
+        for k, v in (
+            ("aluno_id", aluno_id if ver_tudo else None),
+            ("professor", professor),
+            ("de", de.isoformat() if de else None),
+            ("ate", ate.isoformat() if ate else None),
+        )
+        if v
+    }
+    # só o rótulo do seletor: (id, nome), sem carregar o Aluno inteiro
+    aluno_filtro = db.session.execute(
+        select(Aluno.id, Aluno.nome).where(Aluno.id == filtros["aluno_id"])
+    ).first() if "aluno_id" in filtros else None
+
+    return render_template(
+        "atividades/listar.html",
+        atividades=itens,
+        filtros=filtros,
+        aluno_filtro=aluno_filtro,
+        proximo=proximo,
+        cursor=cursor,
+        por_pagina=por_pagina,
+    )
 
 
 app.add_url_rule(
@@ -1324,11 +3090,8 @@ app.add_url_rule(
 
 @app.route("/atividades/novo", methods=["GET", "POST"])
 @login_required
+@requer("atividades_criar", "atividades_listar", "VocÃª nÃ£o tem permissÃ£o para adicionar atividades.")
 def atividades_nova():
-    if not (current_user.is_diretoria() or current_user.is_professor()):
-        flash("VocÃª nÃ£o tem permissÃ£o para adicionar atividades.", "warning")
-        return redirect(url_for("atividades_listar"))
-
     if request.method == "POST":
         aluno_id = request.form.get("aluno_id")
         data_str = request.form.get("data")
@@ -1353,17 +3116,14 @@ def atividades_nova():
         flash("Atividade cadastrada.", "success")
         return redirect(url_for("atividades_listar"))
 
-    alunos = Aluno.query.order_by(Aluno.nome.asc()).all()
+    alunos = opcoes_alunos()
     return render_template("atividades/novo.html", alunos=alunos, item=None)
 
 
 @app.route("/atividades/<int:id>/editar", methods=["GET", "POST"])
 @login_required
+@requer("atividades_editar", "atividades_listar", "VocÃª nÃ£o tem permissÃ£o para editar atividades.")
 def atividades_editar(id):
-    if not current_user.is_diretoria():
-        flash("VocÃª nÃ£o tem permissÃ£o para editar atividades.", "warning")
-        return redirect(url_for("atividades_listar"))
-
     atv = Atividade.query.get_or_404(id)
 
     if request.method == "POST":
@@ -1392,18 +3152,15 @@ def atividades_editar(id):
         flash("Atividade atualizada.", "success")
         return redirect(url_for("atividades_listar"))
 
-    alunos = Aluno.query.order_by(Aluno.nome.asc()).all()
+    alunos = opcoes_alunos()
     return render_template("atividades/form.html", item=atv, alunos=alunos)
 
 
 
 @app.route("/atividades/<int:id>/excluir", methods=["POST"])
 @login_required
+@requer("atividades_editar", "atividades_listar", "VocÃª nÃ£o tem permissÃ£o para excluir atividades.")
 def atividades_excluir(id):
-    if not current_user.is_diretoria():
-        flash("VocÃª nÃ£o tem permissÃ£o para excluir atividades.", "warning")
-        return redirect(url_for("atividades_listar"))
-
     atv = Atividade.query.get_or_404(id)
     db.session.delete(atv)
     db.session.commit()
@@ -1411,6 +3168,315 @@ def atividades_excluir(id):
     return redirect(url_for("atividades_listar"))
 
 
+# -------------------------------------------------------------------
+# COMUNICADOS
+# -------------------------------------------------------------------
+@app.route("/comunicados/", methods=["GET", "POST"])
+@login_required
+@requer("comunicados_enviar")
+def comunicados_listar():
+    if request.method == "POST":
+        alvo = request.form.get("alvo", "")
+        alvo_id = request.form.get(f"{alvo}_id", type=int) if alvo in ("serie", "horario") else None
+        assunto = request.form.get("assunto", "").strip()
+        mensagem = request.form.get("mensagem", "").strip()
+        canais = [c for c in request.form.getlist("canais") if c in CANAIS_COMUNICADO]
+
+        if not alvo_id or not assunto or not mensagem or not canais:
+            flash("Escolha a série ou horário, os canais e preencha assunto e mensagem.", "warning")
+            return redirect(url_for("comunicados_listar"))
+
+        com = criar_comunicado(alvo, alvo_id, assunto, mensagem, canais, current_user.id)
+        if com.total:
+            flash(f"Comunicado na fila: {com.total} mensagem(ns).", "success")
+        else:
+            flash("Nenhum responsável com contato cadastrado para esse grupo.", "warning")
+        return redirect(url_for("comunicados_listar"))
+
+    comunicados = (
+        Comunicado.query.order_by(Comunicado.id.desc()).limit(20).all()
+    )
+    nomes = {
+        "serie": {s.id: s.nome for s in opcoes_series()},
+        "horario": {h.id: f"{h.hora_inicio} - {h.hora_fim}" for h in opcoes_horarios()},
+    }
+    return render_template(
+        "comunicados/listar.html",
+        comunicados=comunicados,
+        nomes=nomes,
+        series=opcoes_series(),
+        horarios=opcoes_horarios(),
+    )
+
+
+@app.route("/comunicados/<int:id>/progresso")
+@login_required
+@requer("comunicados_enviar")
+def comunicados_progresso(id):
+    com = db.get_or_404(Comunicado, id)
+    return jsonify(progresso_comunicado(com))
+
+
+# -------------------------------------------------------------------
+# DIAGNÓSTICO DE ÍNDICES (flask index-advisor)
+# -------------------------------------------------------------------
+def _consultas_das_rotas():
+    """
+    Consultas das rotas, montadas pelas mesmas funções que as views usam
+    (com valores de exemplo). (nome, consulta, varredura esperada?)
+    """
+    hoje = date.today()
+    return [
+        ("login / esqueci", Usuario.query.filter_by(email="x@x.com"), False),
+        ("load_user", _consulta_snapshot_usuario(1), False),
+        ("alunos_list", _consulta_alunos().limit(51), False),
+        ("alunos_list (cursor)", _consulta_alunos(("M", 1)).limit(51), False),
+        # o quadro mostra todos os alunos: ler a tabela inteira é o esperado
+        ("horarios_list", _consulta_horarios(), True),
+        ("horarios_list (alunos por horário)", _consulta_alunos_por_horario(), True),
+        # a mesma consulta da rota: índice textual (FTS5/tsvector) se instalado,
+        # senão ILIKE '%q%', que não usa índice B-tree (varredura esperada).
+        # A ordenação por relevância só ordena as linhas encontradas.
+        (
+            "alunos_search" + ("" if _tem_busca_textual() else " (ILIKE, sem índice textual)"),
+            _consulta_busca_alunos("ana", BUSCA_LIMITE_PADRAO),
+            not _tem_busca_textual(),
+        ),
+        ("atividades_listar", _consulta_atividades().limit(51), False),
+        (
+            "atividades_listar (aluno + período)",
+            _consulta_atividades(aluno_id=1, de=hoje, ate=hoje).limit(51),
+            False,
+        ),
+        (
+            "atividades_listar (cursor)",
+            _consulta_atividades(cursor=(hoje, 1)).limit(51),
+            False,
+        ),
+        # ILIKE '%professor%' também varre
+        ("atividades_listar (professor)", _consulta_atividades(professor="ana").limit(51), True),
+        ("usuarios por aluno", Usuario.query.filter(Usuario.aluno_id == 1), False),
+        ("professores_listar", _consulta_professores(), True),
+    ]
+
+
+def _plano(query):
+    """
+    Devolve (linhas do plano, houve varredura?) para uma Query ou Select.
+    No SQLite todo SCAN conta, inclusive o de índice inteiro, exceto pelo
+    índice de cobertura/chave primária, pelo índice textual (FTS5) ou, com
+    LIMIT, na ordem de um índice (a leitura para no LIMIT).
+    """
+    dialeto = db.engine.dialect
+    stmt = getattr(query, "statement", query)
+    sql = str(stmt.compile(dialect=dialeto, compile_kwargs={"literal_binds": True}))
+    if dialeto.name == "sqlite":
+        linhas = [r[-1] for r in db.session.execute(sa_text("EXPLAIN QUERY PLAN " + sql))]
+        com_limite = " LIMIT " in sql.upper()
+        # com o índice textual, o ORDER BY por relevância só ordena os encontrados
+        textual = any("VIRTUAL TABLE INDEX" in l for l in linhas)
+
+        def varre(l):
+            if "TEMP B-TREE" in l:
+                return not textual
+            if not l.startswith("SCAN ") or "CONSTANT ROW" in l:
+                return False
+            if "USING COVERING INDEX" in l or "USING INTEGER PRIMARY KEY" in l or "VIRTUAL TABLE INDEX" in l:
+                return False
+            return not (com_limite and " USING INDEX " in l)
+
+        scan = any(varre(l) for l in linhas)
+    else:
+        linhas = [r[0] for r in db.session.execute(sa_text("EXPLAIN " + sql))]
+        scan = any("Seq Scan" in l for l in linhas)
+    return linhas, scan
+
+
+@app.cli.command("index-advisor")
+def index_advisor():
+    """Roda EXPLAIN nas consultas das rotas e aponta varreduras completas."""
+    problemas = 0
+    for nome, query, scan_esperado in _consultas_das_rotas():
+        linhas, scan = _plano(query)
+        if scan and not scan_esperado:
+            status = "FULL SCAN"
+            problemas += 1
+        elif scan:
+            status = "scan (esperado)"
+        else:
+            status = "ok"
+        click.echo(f"[{status}] {nome}")
+        for l in linhas:
+            click.echo(f"    {l}")
+
+    if problemas:
+        click.echo(f"{problemas} consulta(s) com varredura completa.", err=True)
+        raise SystemExit(1)
+
+
+# -------------------------------------------------------------------
+# MINIATURAS DAS FOTOS ANTIGAS (flask fotos-miniaturas)
+# -------------------------------------------------------------------
+@app.cli.command("fotos-miniaturas")
+def fotos_miniaturas():
+    """Gera as miniaturas que faltam para fotos enviadas antes do processamento."""
+    feitas = falhas = 0
+    for foto_path in db.session.execute(
+        select(Aluno.foto_path).where(Aluno.foto_path.isnot(None)).distinct()
+    ).scalars():
+        caminho = os.path.join(app.static_folder, foto_path)
+        if not os.path.exists(caminho) or miniatura(foto_path) != foto_path:
+            continue
+        try:
+            miniaturas_de_existente(caminho)
+            feitas += 1
+        except FotoInvalida as e:
+            falhas += 1
+            click.echo(f"{foto_path}: {e}", err=True)
+    click.echo(f"{feitas} foto(s) com miniaturas novas, {falhas} ilegível(is).")
+
+
+@app.cli.command("fotos-gc")
+def fotos_gc():
+    """Recalcula as referências das fotos e apaga as órfãs (registro e arquivos)."""
+    usos = dict(
+        db.session.execute(
+            select(Aluno.foto_path, func.count()).where(Aluno.foto_path.isnot(None))
+            .group_by(Aluno.foto_path)
+        ).all()
+    )
+    corrigidas = 0
+    for foto in Foto.query.all():
+        n = usos.get(foto.caminho, 0)
+        if foto.referencias != n:
+            foto.referencias = n
+            corrigidas += 1
+    db.session.commit()
+    apagadas = coletar_fotos_orfas()
+
+    # Arquivos no armazenamento por hash sem registro (upload interrompido etc.)
+    conhecidas = set(db.session.execute(select(Foto.sha256)).scalars())
+    soltos = 0
+    for raiz, _, arquivos in os.walk(app.config["UPLOAD_FOLDER"]):
+        if raiz == app.config["UPLOAD_FOLDER"] or raiz.startswith(app.config["UPLOAD_TMP"]):
+            continue  # fotos antigas (nome original) ficam na raiz; .tmp = uploads em andamento
+        for nome in arquivos:
+            if nome.split("_")[0].split(".")[0] not in conhecidas:
+                os.remove(os.path.join(raiz, nome))
+                soltos += 1
+    click.echo(f"{corrigidas} contagem(ns) corrigida(s), {apagadas} foto(s) órfã(s), {soltos} arquivo(s) solto(s).")
+
+
+# -------------------------------------------------------------------
+# WORKER DA FILA DE ENVIOS (flask fila-worker)
+# -------------------------------------------------------------------
+@app.cli.command("fila-worker")
+@click.option("--uma-vez", is_flag=True, help="Processa o que estiver vencido e sai.")
+@click.option("--canal", "canais", multiple=True, help="Só estes canais (repetível).")
+def fila_worker(uma_vez, canais):
+    """Envia as mensagens da fila, com retry exponencial e dead letter."""
+    click.echo(f"fila-worker: canais={', '.join(canais) or 'todos'}")
+    try:
+        _laco_fila_worker(uma_vez, canais)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fechar_transportes()
+
+
+def _laco_fila_worker(uma_vez, canais):
+    proxima_limpeza = 0.0
+    while True:
+        try:
+            enviados, falhas = processar_fila(canais=canais or None)
+            if time.time() >= proxima_limpeza:
+                apagados = limpar_enviados()
+                proxima_limpeza = time.time() + 3600
+                if apagados:
+                    click.echo(f"fila-worker: {apagados} envio(s) antigo(s) apagado(s)")
+        except Exception as e:
+            db.session.rollback()
+            click.echo(f"fila-worker: erro ao ler a fila: {e}", err=True)
+            enviados = falhas = 0
+        finally:
+            db.session.remove()
+        if enviados or falhas:
+            click.echo(f"fila-worker: {enviados} enviado(s), {falhas} falha(s)")
+        if uma_vez and not (enviados or falhas):
+            break
+        if not (enviados or falhas):
+            time.sleep(app.config["FILA_INTERVALO"])
+
+
+# -------------------------------------------------------------------
+# MIGRAÇÕES (flask db upgrade / flask db status)
+# -------------------------------------------------------------------
+@app.cli.group("db")
+def db_cli():
+    """Schema do banco (revisões numeradas em schema_version)."""
+
+
+@db_cli.command("upgrade")
+@click.option("--ate", type=int, help="Para nesta revisão (inclusive).")
+def db_upgrade(ate):
+    """Aplica as revisões pendentes. Rodar uma vez por deploy, antes dos workers."""
+    try:
+        feitas = migracoes.upgrade(db.engine, ate=ate, eco=click.echo)
+    except ErroMigracao as e:
+        raise click.ClickException(str(e))
+    click.echo(f"{feitas} revisão(ões) aplicada(s); banco na {migracoes.ultima if ate is None else ate}.")
+
+
+@db_cli.command("backfill")
+@click.argument("nome", required=False)
+@click.option("--lote", type=int, help="Linhas por transação (padrão: BACKFILL_LOTE).")
+@click.option("--pausa", type=float, help="Segundos entre lotes (padrão: BACKFILL_PAUSA).")
+@click.option("--reiniciar", is_flag=True, help="Ignora o progresso salvo e começa do id 1.")
+def db_backfill(nome, lote, pausa, reiniciar):
+    """Migração de dados em lotes, retomável; sem NOME lista os backfills."""
+    if nome is None:
+        with db.engine.connect() as conn:
+            for bf in migracoes.backfills.values():
+                estado = migracoes.progresso(conn, bf.nome)
+                if estado is None:
+                    situacao = "não iniciado"
+                elif estado["concluido_em"]:
+                    situacao = f"concluído ({estado['processadas']} linhas)"
+                else:
+                    situacao = f"parado no id {estado['ultimo_id']} ({estado['processadas']} linhas)"
+                click.echo(f"{bf.nome:<20} {bf.tabela:<12} {situacao}")
+        return
+    if nome not in migracoes.backfills:
+        raise click.ClickException(f"backfill desconhecido: {nome}")
+    try:
+        migracoes.rodar_backfill(
+            db.engine, nome,
+            lote=lote or app.config["BACKFILL_LOTE"],
+            pausa=app.config["BACKFILL_PAUSA"] if pausa is None else pausa,
+            reiniciar=reiniciar, eco=click.echo,
+        )
+    except KeyboardInterrupt:
+        click.echo(f"{nome}: interrompido; rode de novo para continuar de onde parou.")
+
+
+@db_cli.command("status")
+def db_status():
+    """Lista as revisões, aplicadas ou pendentes, e confere os checksums."""
+    linhas, erros = migracoes.status(db.engine)
+    for rev, checksum in linhas:
+        if checksum is None:
+            situacao = "pendente"
+        elif checksum == rev.checksum:
+            situacao = "aplicada"
+        else:
+            situacao = "ALTERADA"
+        click.echo(f"{rev.numero:04d}  {situacao:<9} {rev.nome}")
+    for erro in erros:
+        click.echo(f"erro: {erro}", err=True)
+    if erros:
+        sys.exit(1)
+
+
 # -------------------------------------------------------------------
 # SEED ADMIN
 # -------------------------------------------------------------------
@@ -1426,13 +3492,102 @@ def seed_admin():
         db.session.commit()
 
 
+@app.cli.command("init")
+def init_cmd():
+    """Preparação única da instalação/deploy: schema, pastas e admin inicial."""
+    feitas = migracoes.upgrade(db.engine, eco=click.echo)
+    os.makedirs(app.config["UPLOAD_TMP"], exist_ok=True)
+    seed_admin()
+    click.echo(f"Pronto: {feitas} revisão(ões) aplicada(s), uploads em {app.config['UPLOAD_FOLDER']}.")
+
+
+# -------------------------------------------------------------------
+# FÁBRICA DO APP
+# -------------------------------------------------------------------
+def create_app(config=None):
+    """
+    Devolve o app pronto para servir. Rotas, models e comandos são
+    registrados no import, que não cria engine nem lê templates; aqui fica
+    o que custa tempo ou abre recursos: opções do pool (pela URI final),
+    engines do banco, login e a conferência dos templates. Schema, pastas
+    e seed ficam no `flask init`, rodado uma vez por deploy.
+
+        gunicorn "app:create_app()"      (ver gunicorn.conf.py)
+        flask --app "app:create_app()" fila-worker
+
+    O app é um por processo: a primeira chamada aplica `config` e liga as
+    extensões; as seguintes devolvem o mesmo app e recusam config nova,
+    que não chegaria mais aos engines já criados.
+    """
+    if "sqlalchemy" in app.extensions:
+        if config:
+            raise RuntimeError("create_app(config) depois que o app já foi criado")
+        return app
+    if config:
+        app.config.update(config)
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS", _opcoes_engine(app.config["SQLALCHEMY_DATABASE_URI"])
+    )
+    db.init_app(app)
+    login_manager.init_app(app)
+    verificar_permissoes_templates()
+    return app
+
+
+# -------------------------------------------------------------------
+# GUNICORN (preload_app): aquecimento antes do fork
+# -------------------------------------------------------------------
+def aquecer():
+    """
+    Carrega antes do fork (gunicorn com preload_app) o que todo worker vai
+    ler: templates compilados, caches de referência e o índice de nomes.
+    Essas páginas de memória ficam compartilhadas (copy-on-write) entre os
+    workers. As conexões abertas aqui são fechadas no fim; nenhum socket do
+    banco atravessa o fork.
+    """
+    create_app()
+    for nome in app.jinja_env.list_templates(extensions=("html",)):
+        try:
+            app.jinja_env.get_template(nome)
+        except Exception as e:
+            app.logger.warning("Template %s não compilou: %s", nome, e)
+    with app.app_context():
+        try:
+            opcoes_escolas()
+            opcoes_series()
+            opcoes_horarios()
+            opcoes_alunos()
+            _tem_busca_textual()
+            indice_nomes()
+        except Exception as e:
+            # banco ainda sem schema (antes do `flask init`): cada worker carrega no uso
+            app.logger.warning("Caches não aquecidos: %s", e)
+        finally:
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+
+def depois_do_fork():
+    """
+    Em cada worker, logo após o fork (post_fork do gunicorn). Os engines
+    herdados do master ficam com pool novo e vazio; dispose(close=False) não
+    encerra as conexões do processo pai, só as esquece. Transportes de envio
+    (SMTP, Resend) também são por processo.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    _transportes.clear()
+
+
 # -------------------------------------------------------------------
 # BOOT
 # -------------------------------------------------------------------
 if __name__ == "__main__":
+    create_app()
     with app.app_context():
-        db.create_all()
-        ensure_schema()
+        migracoes.upgrade(db.engine)
         seed_admin()
     app.run(debug=True)
 
@@ -0,0 +1,104 @@
+"""
+Benchmark da busca fuzzy (busca_fuzzy.IndiceTrigramas).
+
+Uso: python bench_busca_fuzzy.py [N ...]      (padrão: 10000 100000 1000000)
+
+Gera N nomes sintéticos, monta o índice e mede a latência de buscas com
+erros de digitação/grafia (p50, p99 e máximo, em ms). Depois reconstrói o
+índice numa thread, como o app faz ao vencer o TTL, e mede o tempo da
+reconstrução e a latência das buscas no índice atual enquanto ela roda.
+"""
+import random
+import sys
+import threading
+import time
+
+from busca_fuzzy import IndiceTrigramas
+
+PRENOMES = [
+    "Ana", "Maria", "João", "José", "Luís", "Luiz", "Thiago", "Tiago", "Pedro",
+    "Paulo", "Lucas", "Gabriel", "Rafael", "Matheus", "Mateus", "Isabella",
+    "Izabela", "Júlia", "Beatriz", "Larissa", "Felipe", "Filipe", "Guilherme",
+    "Vinícius", "Letícia", "Camila", "Bruno", "Carlos", "Sofia", "Heloísa",
+]
+SOBRENOMES = [
+    "Silva", "Santos", "Oliveira", "Souza", "Sousa", "Rodrigues", "Ferreira",
+    "Alves", "Pereira", "Lima", "Gomes", "Costa", "Ribeiro", "Martins",
+    "Carvalho", "Almeida", "Lopes", "Soares", "Fernandes", "Vieira", "Barbosa",
+    "Rocha", "Dias", "Nascimento", "Andrade", "Moreira", "Nunes", "Marques",
+]
+CONSULTAS = 500
+
+
+def gerar_nomes(n, rnd):
+    for i in range(n):
+        partes = [rnd.choice(PRENOMES)] + rnd.sample(SOBRENOMES, rnd.randint(1, 3))
+        yield i + 1, " ".join(partes)
+
+
+def com_erro(nome, rnd):
+    """Troca/remove uma letra e às vezes corta o fim (como no autocomplete)."""
+    s = list(nome)
+    i = rnd.randrange(len(s))
+    if rnd.random() < 0.5:
+        s[i] = rnd.choice("aeiousz")
+    else:
+        del s[i]
+    s = "".join(s)
+    if rnd.random() < 0.5:
+        s = s[: max(4, len(s) * 2 // 3)]
+    return s
+
+
+def medir(n):
+    rnd = random.Random(n)
+    nomes = list(gerar_nomes(n, rnd))
+    indice = IndiceTrigramas()
+
+    t0 = time.perf_counter()
+    indice.construir(nomes)
+    construcao = time.perf_counter() - t0
+
+    tempos = buscar(indice, nomes, rnd, CONSULTAS)
+    print(f"{n:>9} nomes | construção {construcao:6.1f} s | {percentis(tempos)}")
+
+    reconstrucao = []
+
+    def reconstruir():
+        t0 = time.perf_counter()
+        IndiceTrigramas().construir(nomes)
+        reconstrucao.append(time.perf_counter() - t0)
+
+    thread = threading.Thread(target=reconstruir)
+    thread.start()
+    tempos = []
+    while thread.is_alive() or not tempos:
+        tempos += buscar(indice, nomes, rnd, 20)
+    thread.join()
+    print(
+        f"{'':>9}       | reconstrução {reconstrucao[0]:4.1f} s | "
+        f"{percentis(tempos)} (durante)"
+    )
+
+
+def buscar(indice, nomes, rnd, vezes):
+    tempos = []
+    for _ in range(vezes):
+        q = com_erro(rnd.choice(nomes)[1], rnd)
+        t0 = time.perf_counter()
+        indice.buscar(q, 20)
+        tempos.append((time.perf_counter() - t0) * 1000)
+    return tempos
+
+
+def percentis(tempos):
+    tempos = sorted(tempos)
+    p50 = tempos[len(tempos) // 2]
+    p99 = tempos[max(0, int(len(tempos) * 0.99) - 1)]
+    return f"p50 {p50:6.2f} ms | p99 {p99:6.2f} ms | máx {tempos[-1]:6.2f} ms"
+
+
+if __name__ == "__main__":
+    tamanhos = [int(x) for x in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n in tamanhos:
+        medir(n)
@@ -0,0 +1,102 @@
+"""
+Benchmark do transporte de e-mail (transporte_email.PoolSMTP) contra um
+servidor SMTP local (aiosmtpd: pip install -r requirements-dev.txt).
+
+Uso: python bench_email.py [N] [ATRASO_MS]     (padrão: 500 mensagens, 50 ms)
+
+ATRASO_MS simula o custo de abrir uma sessão num servidor real (TCP + TLS +
+AUTH); o servidor local espera esse tempo no EHLO. Compara uma conexão por
+mensagem (como era antes) com o pool e com o envio em lote.
+"""
+import asyncio
+import smtplib
+import sys
+import time
+from email.mime.text import MIMEText
+
+from transporte_email import PoolSMTP
+
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import SMTP as ServidorSMTP
+except ImportError:
+    sys.exit("Instale o aiosmtpd para rodar o benchmark: pip install aiosmtpd")
+
+HOST = "127.0.0.1"
+PORTA = 8025
+
+
+class Contador:
+    def __init__(self):
+        self.recebidas = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recebidas += 1
+        return "250 OK"
+
+
+class ServidorLento(ServidorSMTP):
+    atraso = 0.0
+
+    async def smtp_EHLO(self, hostname):
+        await asyncio.sleep(self.atraso)
+        return await super().smtp_EHLO(hostname)
+
+
+class ControladorLento(Controller):
+    def factory(self):
+        return ServidorLento(self.handler)
+
+
+def mensagens(n):
+    return [(f"resp{i}@exemplo.com", "Circular", f"Mensagem {i}") for i in range(n)]
+
+
+def uma_conexao_por_mensagem(lista):
+    for destino, assunto, corpo in lista:
+        msg = MIMEText(corpo)
+        msg["Subject"] = assunto
+        msg["From"] = "escola@exemplo.com"
+        msg["To"] = destino
+        servidor = smtplib.SMTP(HOST, PORTA, timeout=20)
+        servidor.sendmail("escola@exemplo.com", [destino], msg.as_string())
+        servidor.quit()
+
+
+def pool_mensagem_a_mensagem(lista):
+    pool = PoolSMTP(HOST, PORTA, None, None, remetente="escola@exemplo.com")
+    for destino, assunto, corpo in lista:
+        pool.enviar(destino, assunto, corpo)
+    pool.fechar()
+
+
+def pool_em_lote(lista):
+    pool = PoolSMTP(HOST, PORTA, None, None, remetente="escola@exemplo.com")
+    erros = [e for e in pool.enviar_lote(lista) if e]
+    assert not erros, erros[:3]
+    pool.fechar()
+
+
+def medir(nome, funcao, lista, contador):
+    antes = contador.recebidas
+    t0 = time.perf_counter()
+    funcao(lista)
+    dt = time.perf_counter() - t0
+    assert contador.recebidas - antes == len(lista)
+    print(f"{nome:<28} {len(lista):>5} msgs | {dt:7.2f} s | {len(lista) / dt:8.1f} msgs/s")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    ServidorLento.atraso = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+
+    contador = Contador()
+    controlador = ControladorLento(contador, hostname=HOST, port=PORTA)
+    controlador.start()
+    try:
+        lista = mensagens(n)
+        medir("uma conexão por mensagem", uma_conexao_por_mensagem, lista, contador)
+        medir("pool (enviar)", pool_mensagem_a_mensagem, lista, contador)
+        medir("pool (enviar_lote)", pool_em_lote, lista, contador)
+    finally:
+        controlador.stop()
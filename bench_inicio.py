@@ -0,0 +1,75 @@
+"""
+Benchmark do tempo de subida do app (import + create_app), o que cada
+worker do gunicorn paga ao nascer ou ser reciclado.
+
+Uso: python bench_inicio.py [N] [TOP]     (padrão: 5 rodadas, 15 módulos)
+
+Cada rodada é um processo novo com `python -X importtime`, então o cache
+de módulos não ajuda. Mostra a mediana do import do app e do create_app(),
+os imports diretos mais caros (tempo acumulado, da rodada mediana) e se alguma
+dependência que deveria ser carregada só no uso (LAZY) entrou no import.
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# Só devem ser importados por quem usa (envio de e-mail, fotos, WhatsApp)
+LAZY = ("requests", "smtplib", "email.mime.text", "PIL.Image", "selenium", "transporte_email")
+
+SCRIPT = """
+import time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(f"TEMPOS {(t1 - t0) * 1000:.1f} {(t2 - t1) * 1000:.1f}")
+"""
+
+_LINHA = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def rodada():
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCRIPT],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True,
+    )
+    t_import, t_create = map(float, r.stdout.split("TEMPOS")[1].split())
+    # O importtime lista os filhos antes do pai: os imports diretos do app são
+    # as linhas de nível 1 entre a linha de nível 0 anterior e a do "app".
+    modulos, diretos, nivel1 = {}, {}, {}
+    for linha in r.stderr.splitlines():
+        m = _LINHA.match(linha)
+        if not m:
+            continue
+        modulos[m[4]] = int(m[2]) / 1000   # acumulado, ms
+        if len(m[3]) == 3:
+            nivel1[m[4]] = modulos[m[4]]
+        elif len(m[3]) == 1:
+            if m[4] == "app":
+                diretos = nivel1
+            nivel1 = {}
+    return t_import, t_create, modulos, diretos
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+
+    rodadas = sorted((rodada() for _ in range(n)), key=lambda r: r[0])
+    mediana = rodadas[len(rodadas) // 2]
+    print(f"import app     {statistics.median(r[0] for r in rodadas):8.1f} ms (mediana de {n})")
+    print(f"create_app()   {statistics.median(r[1] for r in rodadas):8.1f} ms")
+
+    print("\nImports do app mais caros (acumulado, ms):")
+    for nome, ms in sorted(mediana[3].items(), key=lambda x: -x[1])[:top]:
+        print(f"  {nome:<40} {ms:8.1f}")
+
+    carregados = [nome for nome in LAZY if nome in mediana[2]]
+    if carregados:
+        print("\nAtenção: importados na subida, deveriam ser lazy:", ", ".join(carregados))
+        sys.exit(1)
+    print("\nNenhuma dependência lazy importada na subida.")
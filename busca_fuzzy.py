@@ -0,0 +1,147 @@
+"""
+Índice de trigramas em memória para a busca de alunos tolerante a erros
+de digitação ("Luís"/"Luiz", "Thiago"/"Tiago", "Sousa"/"Souza").
+
+Cada worker mantém o seu índice (id -> trigramas do nome) e o atualiza nas
+rotas de cadastro/edição/exclusão. A busca lê no máximo `orcamento` entradas
+das listas de postings, começando pelos trigramas mais raros, então o tempo
+de resposta fica limitado mesmo com muitos nomes.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+from array import array
+from operator import itemgetter
+
+# Grafias equivalentes comuns em nomes brasileiros (aplicadas sem acento)
+_REGRAS = [
+    (re.compile(r"th"), "t"),
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"y"), "i"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"z\b"), "s"),
+    (re.compile(r"(?<=[aeiou])z(?=[aeiou])"), "s"),
+    (re.compile(r"([a-z])\1"), r"\1"),  # letras dobradas: "Isabella" ~ "Isabela"
+]
+_NAO_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas, sem acento, com as grafias equivalentes unificadas."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = _NAO_ALNUM.sub(" ", texto)
+    for regra, troca in _REGRAS:
+        texto = regra.sub(troca, texto)
+    return texto.strip()
+
+
+def trigramas(texto: str) -> frozenset:
+    """Trigramas de cada palavra, com dois espaços antes e um depois (como o pg_trgm)."""
+    tris = set()
+    for palavra in normalizar(texto).split():
+        p = f"  {palavra} "
+        tris.update(p[i:i + 3] for i in range(len(p) - 2))
+    return frozenset(tris)
+
+
+class IndiceTrigramas:
+    """Índice invertido trigrama -> ids, com remoção lógica e compactação."""
+
+    def __init__(self, orcamento: int = 50000):
+        self.orcamento = orcamento
+        self._postings = {}   # trigrama -> array("i") de ids
+        self._tris = {}       # id -> frozenset de trigramas atuais
+        self._nomes = {}      # id -> nome original
+        self._total = 0       # entradas nas listas de postings
+        self._obsoletas = 0   # entradas que apontam para versões antigas
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._nomes)
+
+    def construir(self, pares):
+        """Recria o índice a partir de pares (id, nome)."""
+        with self._lock:
+            self._postings, self._tris, self._nomes = {}, {}, {}
+            self._total = self._obsoletas = 0
+            for id_, nome in pares:
+                self._inserir(id_, nome)
+
+    def adicionar(self, id_, nome):
+        """Insere ou atualiza um nome."""
+        with self._lock:
+            if id_ in self._tris:
+                self.remover(id_)
+            self._inserir(id_, nome)
+
+    def remover(self, id_):
+        with self._lock:
+            tris = self._tris.pop(id_, None)
+            self._nomes.pop(id_, None)
+            if tris:
+                # As listas de postings não são editadas aqui (O(n)); a busca
+                # confere os trigramas atuais e a compactação limpa depois.
+                self._obsoletas += len(tris)
+                if self._obsoletas > max(1000, self._total // 4):
+                    self._compactar()
+
+    def buscar(self, q: str, limite: int = 20, minimo: float = 0.5):
+        """
+        Devolve até `limite` tuplas (id, nome, score), da maior para a menor
+        nota. score = fração dos trigramas da busca presentes no nome, o que
+        favorece o autocomplete (nome parcial ainda pontua alto).
+        """
+        qt = trigramas(q)
+        if not qt:
+            return []
+        with self._lock:
+            listas = sorted(
+                (self._postings[t] for t in qt if t in self._postings), key=len
+            )
+            contagem = {}
+            restante = self.orcamento
+            for lista in listas:
+                if restante <= 0:
+                    break
+                for id_ in lista[:restante] if len(lista) > restante else lista:
+                    contagem[id_] = contagem.get(id_, 0) + 1
+                restante -= len(lista)
+
+            candidatos = heapq.nlargest(limite * 5, contagem.items(), key=itemgetter(1))
+            resultado = []
+            for id_, _ in candidatos:
+                tris = self._tris.get(id_)
+                if not tris:
+                    continue
+                comuns = len(qt & tris)
+                score = comuns / len(qt)
+                if score >= minimo:
+                    jaccard = comuns / (len(qt) + len(tris) - comuns)
+                    resultado.append((score, jaccard, self._nomes[id_], id_))
+
+        resultado.sort(key=lambda r: (-r[0], -r[1], r[2]))
+        return [(id_, nome, round(score, 3)) for score, _, nome, id_ in resultado[:limite]]
+
+    def _inserir(self, id_, nome):
+        tris = trigramas(nome)
+        self._tris[id_] = tris
+        self._nomes[id_] = nome
+        for t in tris:
+            lista = self._postings.get(t)
+            if lista is None:
+                lista = self._postings[t] = array("i")
+            lista.append(id_)
+        self._total += len(tris)
+
+    def _compactar(self):
+        self._postings = {}
+        self._total = self._obsoletas = 0
+        for id_, tris in self._tris.items():
+            for t in tris:
+                lista = self._postings.get(t)
+                if lista is None:
+                    lista = self._postings[t] = array("i")
+                lista.append(id_)
+            self._total += len(tris)
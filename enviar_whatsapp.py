@@ -1,15 +1,57 @@
 import sys
-import time
 import urllib.parse
 import os
 
 from selenium import webdriver
+from selenium.common.exceptions import (
+    StaleElementReferenceException,
+    TimeoutException,
+    WebDriverException,
+)
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 
 
-PROFILE_DIR = r"C:/alunos_app/ChromeProfileWPP"
+PROFILE_DIR = os.getenv("WHATSAPP_PROFILE_DIR", r"C:/alunos_app/ChromeProfileWPP")
+
+# Tempos MÁXIMOS de espera (s); as esperas terminam assim que a página fica pronta
+ESPERA_LOGIN = 120        # primeira vez: tempo para escanear o QR Code
+ESPERA_CARREGAR = 60      # WhatsApp Web abrir com o perfil já logado
+ESPERA_CHAT = 30          # conversa abrir com o texto preenchido
+ESPERA_ENVIO = 30         # mensagem aparecer e sair do "relógio" (pendente)
+
+PAINEL_CONVERSAS = (By.ID, "side")
+BOTAO_ENVIAR = (
+    By.XPATH,
+    "//button[@aria-label='Enviar' or @aria-label='Send'] | //span[@data-icon='send']",
+)
+CAMPO_MENSAGEM = (By.XPATH, "//div[@title='Mensagem' or @title='Type a message']")
+POPUP = (By.CSS_SELECTOR, "div[data-animate-modal-popup='true']")
+PENDENTE = (By.CSS_SELECTOR, "span[data-icon='msg-time']")
+MENSAGEM_SAIDA = (By.CSS_SELECTOR, "div.message-out")
+CONFIRMADA = (By.CSS_SELECTOR, "span[data-icon='msg-check'], span[data-icon='msg-dblcheck']")
+
+
+def _saidas(driver):
+    return driver.find_elements(*MENSAGEM_SAIDA)
+
+
+def _ultima_confirmada(driver):
+    """A última mensagem enviada já tem o check (saiu do relógio)?"""
+    try:
+        ultima = _saidas(driver)[-1]
+        return bool(ultima.find_elements(*CONFIRMADA)) and not ultima.find_elements(*PENDENTE)
+    except (IndexError, StaleElementReferenceException):
+        return False
+
+
+class NumeroInvalido(ValueError):
+    """Número sem WhatsApp ou inválido: tentar de novo não adianta."""
+
+    permanente = True   # a fila manda direto para a dead letter (app._registrar_resultado)
 
 
 def criar_chrome(headless: bool) -> webdriver.Chrome:
@@ -37,73 +79,104 @@ def criar_chrome(headless: bool) -> webdriver.Chrome:
     return driver
 
 
-def enviar_mensagem_whatsapp(numero: str, mensagem: str):
-    texto = urllib.parse.quote(mensagem)
-    url = f"https://web.whatsapp.com/send?phone={numero}&text={texto}"
-
-    # Se o perfil ainda não existe, é a primeira vez -> abre visível
-    primeira_vez = not os.path.exists(PROFILE_DIR)
+class SessaoWhatsApp:
+    """
+    Um navegador logado no WhatsApp Web, reaproveitado entre mensagens.
+    Usado pelo worker da fila (flask fila-worker --canal whatsapp); se o
+    Chrome cair, a próxima mensagem abre outro.
+    """
 
-    driver = criar_chrome(headless=not primeira_vez)
+    def __init__(self):
+        self.driver = None
 
-    try:
-        driver.get(url)
+    def _abrir(self):
+        # Se o perfil ainda não existe, é a primeira vez -> abre visível
+        primeira_vez = not os.path.exists(PROFILE_DIR)
+        self.driver = criar_chrome(headless=not primeira_vez)
+        self.driver.get("https://web.whatsapp.com")
         print("Carregando WhatsApp Web...")
 
         if primeira_vez:
             print("\n==== ATENÇÃO ====")
             print("Parece ser a primeira vez que você está usando este perfil.")
-            print("Escaneie o QR Code no WhatsApp Web para logar.")
-            print("Vou aguardar 30 segundos para você fazer o login...\n")
-            time.sleep(30)
-        else:
-            # Já logado, só espera carregar chat
-            time.sleep(12)
-
-        # Aguarda mais um pouco pra garantir que o chat carregou
-        time.sleep(5)
-
-        # Tenta clicar no botão de enviar (ícone de aviãozinho)
-        try:
-            print("Tentando enviar pelo ícone de enviar...")
-            btn = driver.find_element(By.CSS_SELECTOR, "span[data-icon='send']")
-            btn.click()
-            print("Mensagem enviada com sucesso (método 1).")
-            time.sleep(4)
-            return True
-        except Exception as e1:
-            print("Método 1 falhou:", e1)
-
-        # Tenta via aria-label
+            print(f"Escaneie o QR Code no WhatsApp Web (aguardando até {ESPERA_LOGIN} s)...\n")
+        espera = ESPERA_LOGIN if primeira_vez else ESPERA_CARREGAR
         try:
-            print("Tentando enviar pelo botão com aria-label...")
-            btn = driver.find_element(
-                By.XPATH, "//button[@aria-label='Enviar' or @aria-label='Send']"
+            WebDriverWait(self.driver, espera).until(
+                EC.presence_of_element_located(PAINEL_CONVERSAS)
             )
-            btn.click()
-            print("Mensagem enviada com sucesso (método 2).")
-            time.sleep(4)
-            return True
-        except Exception as e2:
-            print("Método 2 falhou:", e2)
-
-        # Como último recurso, tenta simular ENTER no campo de mensagem
+        except TimeoutException:
+            self.fechar()
+            raise RuntimeError("WhatsApp Web não carregou (perfil deslogado?)")
+
+    def _garantir_aberta(self):
+        if self.driver is not None:
+            try:
+                self.driver.current_url  # só confere se o Chrome ainda responde
+                return
+            except WebDriverException:
+                self.fechar()
+        self._abrir()
+
+    def enviar(self, numero: str, mensagem: str):
+        """Envia e só retorna depois que a mensagem saiu; erro -> exceção."""
+        self._garantir_aberta()
+        texto = urllib.parse.quote(mensagem)
+        self.driver.get(f"https://web.whatsapp.com/send?phone={numero}&text={texto}")
+
+        espera = WebDriverWait(self.driver, ESPERA_CHAT)
         try:
-            print("Tentando enviar simulando ENTER no campo de mensagem...")
-            campo = driver.find_element(By.XPATH, "//div[@title='Mensagem' or @title='Type a message']")
-            campo.send_keys("\n")
-            print("Mensagem enviada com sucesso (método 3).")
-            time.sleep(4)
-            return True
-        except Exception as e3:
-            print("Método 3 falhou:", e3)
-
-        print("Não foi possível enviar a mensagem automaticamente.")
-        return False
+            espera.until(EC.any_of(
+                EC.element_to_be_clickable(BOTAO_ENVIAR),
+                EC.presence_of_element_located(POPUP),
+            ))
+        except TimeoutException:
+            raise RuntimeError("Conversa não abriu a tempo")
+
+        if self.driver.find_elements(*POPUP) and not self.driver.find_elements(*BOTAO_ENVIAR):
+            # "O número de telefone compartilhado por url é inválido"
+            raise NumeroInvalido(f"Número sem WhatsApp ou inválido: {numero}")
+
+        antes = len(_saidas(self.driver))
+        try:
+            self.driver.find_element(*BOTAO_ENVIAR).click()
+        except WebDriverException:
+            # Como último recurso, ENTER no campo de mensagem
+            self.driver.find_element(*CAMPO_MENSAGEM).send_keys("\n")
+
+        # Primeiro o balão novo aparecer (logo depois do clique o relógio ainda
+        # não existe, e "sem relógio" passaria na hora); depois ele ganhar o check.
+        espera = WebDriverWait(self.driver, ESPERA_ENVIO)
+        try:
+            espera.until(lambda d: len(_saidas(d)) > antes)
+        except TimeoutException:
+            raise RuntimeError("Mensagem não apareceu na conversa (o envio não disparou)")
+        try:
+            espera.until(_ultima_confirmada)
+        except TimeoutException:
+            raise RuntimeError("Mensagem ficou pendente (sem conexão no celular?)")
+        print(f"Mensagem enviada para {numero}.")
+
+    def fechar(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+            print("Chrome fechado.")
+
 
+def enviar_mensagem_whatsapp(numero: str, mensagem: str):
+    sessao = SessaoWhatsApp()
+    try:
+        sessao.enviar(numero, mensagem)
+        return True
+    except Exception as e:
+        print("Não foi possível enviar a mensagem:", e)
+        return False
     finally:
-        driver.quit()
-        print("Chrome fechado.")
+        sessao.fechar()
 
 
 def main():
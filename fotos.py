@@ -0,0 +1,125 @@
+"""
+Processamento das fotos de alunos (Pillow).
+
+Toda foto enviada vira:
+  <base>.jpg        imagem principal, no máximo LADO_MAX px, JPEG progressivo
+  <base>_64.webp    miniatura quadrada para listas
+  <base>_256.webp   miniatura quadrada para a ficha do aluno
+
+A orientação do EXIF é aplicada nos pixels e os metadados (EXIF, GPS,
+perfil ICC, comentários) não são copiados para os arquivos gerados. Cada
+arquivo é gravado com outro nome e renomeado no fim (os.replace), então
+quem lê nunca vê uma foto pela metade; a principal é a última a aparecer.
+
+O Pillow só é importado quando uma foto é processada: o app usa daqui
+também as funções leves (tipo_imagem, nome_miniatura) e sobe sem ele.
+"""
+from __future__ import annotations
+
+import os
+import tempfile
+
+LADO_MAX = 1024
+QUALIDADE_JPEG = 85
+QUALIDADE_WEBP = 80
+MINIATURAS = (64, 256)
+MAX_PIXELS = 40_000_000     # ~ 7300 x 5500; acima disso é recusada antes de decodificar
+
+# Assinaturas (magic bytes) dos formatos aceitos
+_ASSINATURAS = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+TAMANHO_CABECALHO = 12
+
+
+class FotoInvalida(ValueError):
+    """O arquivo não é uma imagem que o Pillow consiga ler."""
+
+
+def tipo_imagem(cabecalho: bytes):
+    """Formato pelos primeiros bytes do arquivo, ou None se não for imagem aceita."""
+    if cabecalho[:4] == b"RIFF" and cabecalho[8:12] == b"WEBP":
+        return "webp"
+    for assinatura, tipo in _ASSINATURAS:
+        if cabecalho.startswith(assinatura):
+            return tipo
+    return None
+
+
+def nome_miniatura(foto_path: str, tamanho: int) -> str:
+    """'uploads/x.jpg' -> 'uploads/x_64.webp'."""
+    return f"{os.path.splitext(foto_path)[0]}_{tamanho}.webp"
+
+
+def _abrir(origem) -> Image.Image:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        img = Image.open(origem)
+        if img.width * img.height > MAX_PIXELS:
+            raise FotoInvalida(f"imagem grande demais ({img.width}x{img.height})")
+        # JPEG: decodifica já reduzido (escala 1/2, 1/4, 1/8), bem mais rápido
+        # para fotos de webcam/celular de vários MB
+        img.draft("RGB", (LADO_MAX, LADO_MAX))
+        img = ImageOps.exif_transpose(img)
+        img.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise FotoInvalida(str(e)) from e
+    return img
+
+
+def _rgb(img: Image.Image) -> Image.Image:
+    """Remove transparência sobre fundo branco e devolve uma cópia RGB sem metadados."""
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        fundo = Image.new("RGB", img.size, (255, 255, 255))
+        fundo.paste(img, mask=img.getchannel("A"))
+        img = fundo
+    else:
+        img = img.convert("RGB")
+    img.info = {}
+    return img
+
+
+def _salvar(img: Image.Image, destino: str, formato: str, **opcoes):
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(destino) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        img.save(temporario, formato, **opcoes)
+        os.replace(temporario, destino)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def gerar_miniaturas(img: Image.Image, base: str):
+    from PIL import Image, ImageOps
+
+    for tamanho in MINIATURAS:
+        mini = ImageOps.fit(img, (tamanho, tamanho), Image.Resampling.LANCZOS)
+        _salvar(mini, f"{base}_{tamanho}.webp", "WEBP", quality=QUALIDADE_WEBP, method=4)
+
+
+def processar(origem, base: str):
+    """
+    Lê a imagem de `origem` (caminho ou arquivo) e grava a principal e as
+    miniaturas em `base` + sufixos. Levanta FotoInvalida se não for imagem.
+    """
+    from PIL import Image
+
+    img = _rgb(_abrir(origem))
+    img.thumbnail((LADO_MAX, LADO_MAX), Image.Resampling.LANCZOS)
+    gerar_miniaturas(img, base)
+    _salvar(img, f"{base}.jpg", "JPEG", quality=QUALIDADE_JPEG, optimize=True, progressive=True)
+
+
+def miniaturas_de_existente(caminho: str):
+    """Gera só as miniaturas de uma foto já salva (fotos antigas)."""
+    img = _rgb(_abrir(caminho))
+    gerar_miniaturas(img, os.path.splitext(caminho)[0])
@@ -0,0 +1,49 @@
+"""
+Configuração do gunicorn (lida automaticamente do diretório atual).
+
+    gunicorn "app:create_app()"
+
+Com preload_app o master importa o app uma vez, aquece templates e caches
+(app.aquecer) e só então faz o fork: os workers nascem rápido e dividem as
+páginas de memória só de leitura. Nenhuma conexão do banco é herdada:
+aquecer() fecha as suas antes do fork e post_fork zera o pool de cada
+worker (app.depois_do_fork).
+"""
+import gc
+import os
+
+import servidor
+
+wsgi_app = "app:create_app()"     # `gunicorn` sem argumento usa a fábrica
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# O mesmo WEB_CONCURRENCY (e padrão) divide DB_MAX_CONEXOES entre os workers (app._opcoes_engine)
+workers = servidor.workers()
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+# Reciclagem de workers (vazamentos de memória); o jitter evita todos de uma vez
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+accesslog = "-"
+
+
+def when_ready(server):
+    # Roda no master, depois do preload e antes de criar os workers
+    if not preload_app:
+        return
+    from app import aquecer
+
+    aquecer()
+    # Tira do GC o que já existe: a coleta nos workers não escreve nesses
+    # objetos, e as páginas continuam compartilhadas
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Sem preload cada worker importa o app sozinho, depois do fork
+    if not preload_app:
+        return
+    from app import depois_do_fork
+
+    depois_do_fork()
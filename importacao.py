@@ -0,0 +1,189 @@
+"""
+Leitura de planilhas de alunos (CSV ou XLSX) para o import em massa.
+
+As linhas são lidas uma a uma, sem carregar o arquivo inteiro:
+  - CSV: separador (; , tab) e codificação (UTF-8 ou Windows-1252, o que o
+    Excel em português costuma gravar) detectados no começo do arquivo;
+  - XLSX: openpyxl em modo read_only (pip install openpyxl), primeira aba.
+
+O cabeçalho é casado com os campos do Aluno por nome, sem acento e sem
+diferença de maiúsculas ("Data de nascimento", "SÉRIE", "celular"...).
+A validação contra o banco fica no app (importar_alunos).
+"""
+import codecs
+import csv
+import re
+import unicodedata
+from datetime import date, datetime
+
+# cabeçalho normalizado -> campo
+COLUNAS = {
+    "nome": "nome", "aluno": "nome", "nome_do_aluno": "nome", "nome_completo": "nome",
+    "escola": "escola", "serie": "serie", "ano": "serie",
+    "horario": "horario",
+    "telefone": "telefone_cel", "celular": "telefone_cel", "telefone_cel": "telefone_cel",
+    "telefone_celular": "telefone_cel", "whatsapp": "telefone_cel",
+    "telefone_fixo": "telefone_fixo", "fixo": "telefone_fixo",
+    "data_nascimento": "data_nascimento", "data_de_nascimento": "data_nascimento",
+    "nascimento": "data_nascimento",
+    "naturalidade": "naturalidade", "nacionalidade": "nacionalidade",
+    "idade": "idade", "sexo": "sexo",
+    "nome_pai": "nome_pai", "nome_do_pai": "nome_pai", "pai": "nome_pai",
+    "nome_mae": "nome_mae", "nome_da_mae": "nome_mae", "mae": "nome_mae",
+    "endereco": "endereco", "numero": "numero", "bairro": "bairro",
+    "observacoes": "observacoes", "observacao": "observacoes", "obs": "observacoes",
+    "tem_dificuldade": "tem_dificuldade", "qual_dificuldade": "qual_dificuldade",
+    "toma_medicamento": "toma_medicamento", "qual_medicamento": "qual_medicamento",
+    "medicamento": "qual_medicamento",
+    "inicio_aulas": "inicio_aulas", "inicio_das_aulas": "inicio_aulas",
+    "mensalidade": "mensalidade_opcao", "mensalidade_opcao": "mensalidade_opcao",
+}
+
+_VERDADEIRO = {"sim", "s", "x", "1", "true", "verdadeiro", "yes"}
+_FALSO = {"nao", "n", "0", "false", "falso", "no", ""}
+_FORMATOS_DATA = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%y")
+_AMOSTRA = 64 * 1024
+
+
+class PlanilhaInvalida(ValueError):
+    """Arquivo que não dá para ler como planilha (formato, cabeçalho)."""
+
+
+def normalizar(valor) -> str:
+    """'  Série ' -> 'serie'; usado no cabeçalho e nos nomes de escola/série."""
+    ascii_ = unicodedata.normalize("NFKD", str(valor or "")).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "_", ascii_.casefold()).strip("_")
+
+
+def tipo_planilha(cabecalho: bytes):
+    """'xlsx' (zip), 'csv' (texto) ou None, pelos primeiros bytes."""
+    if cabecalho.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    if b"\x00" not in cabecalho:
+        return "csv"
+    return None
+
+
+def mapear_cabecalho(cabecalho):
+    """[texto da coluna] -> ([campo ou None por coluna], [colunas ignoradas])."""
+    campos, ignoradas, vistos = [], [], set()
+    for coluna in cabecalho:
+        campo = COLUNAS.get(normalizar(coluna))
+        if campo in vistos:
+            campo = None            # coluna repetida: vale a primeira
+        if campo is None and str(coluna or "").strip():
+            ignoradas.append(str(coluna).strip())
+        campos.append(campo)
+        vistos.add(campo)
+    if "nome" not in vistos:
+        raise PlanilhaInvalida("a planilha precisa de uma coluna 'nome' na primeira linha")
+    return campos, ignoradas
+
+
+def _linhas_csv(caminho):
+    with open(caminho, "rb") as f:
+        amostra = f.read(_AMOSTRA)
+    try:
+        # o fim da amostra pode cortar um caractere no meio
+        codecs.getincrementaldecoder("utf-8")().decode(amostra, final=False)
+        codificacao = "utf-8-sig"
+    except UnicodeDecodeError:
+        codificacao = "cp1252"
+    texto = amostra.decode(codificacao, errors="ignore")
+    try:
+        dialeto = csv.Sniffer().sniff(texto.split("\n", 1)[0], delimiters=";,\t")
+    except csv.Error:
+        dialeto = csv.excel
+    with open(caminho, newline="", encoding=codificacao, errors="replace") as f:
+        yield from csv.reader(f, dialeto)
+
+
+def _linhas_xlsx(caminho):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise PlanilhaInvalida("leitura de .xlsx precisa do openpyxl (pip install openpyxl)")
+    # por arquivo aberto: pelo caminho o openpyxl exige a extensão .xlsx
+    with open(caminho, "rb") as f:
+        try:
+            livro = load_workbook(f, read_only=True, data_only=True)
+        except Exception as e:
+            raise PlanilhaInvalida(f"não foi possível abrir o .xlsx: {e}") from e
+        try:
+            yield from livro.worksheets[0].iter_rows(values_only=True)
+        finally:
+            livro.close()
+
+
+def ler_planilha(caminho, tipo):
+    """
+    Lê o cabeçalho e devolve (colunas ignoradas, gerador de linhas). O
+    gerador produz (numero_da_linha, {campo: valor bruto}) para cada linha
+    não vazia; a linha 1 é o cabeçalho.
+    """
+    if tipo not in ("csv", "xlsx"):
+        raise PlanilhaInvalida("formato não reconhecido: use .csv ou .xlsx")
+    linhas = _linhas_xlsx(caminho) if tipo == "xlsx" else _linhas_csv(caminho)
+    try:
+        cabecalho = next(linhas)
+    except StopIteration:
+        raise PlanilhaInvalida("planilha vazia")
+    campos, ignoradas = mapear_cabecalho(cabecalho)
+    return ignoradas, _dados(campos, linhas)
+
+
+def _dados(campos, linhas):
+    for numero, valores in enumerate(linhas, start=2):
+        dados = {
+            campo: valor for campo, valor in zip(campos, valores)
+            if campo and valor is not None and str(valor).strip() != ""
+        }
+        if dados:
+            yield numero, dados
+
+
+# -------------------------------------------------------------------
+# Conversões (ValueError com a mensagem que vai para o relatório)
+# -------------------------------------------------------------------
+def texto(valor, tamanho=None):
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)          # telefone/número que o Excel guardou como número
+    valor = str(valor).strip()
+    if tamanho and len(valor) > tamanho:
+        raise ValueError(f"mais de {tamanho} caracteres")
+    return valor
+
+
+def data(valor):
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    valor = str(valor).strip()
+    for formato in _FORMATOS_DATA:
+        try:
+            return datetime.strptime(valor, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data inválida '{valor}' (use dd/mm/aaaa)")
+
+
+def inteiro(valor):
+    try:
+        numero = float(str(valor).strip().replace(",", "."))
+    except ValueError:
+        raise ValueError(f"número inválido '{valor}'")
+    if not numero.is_integer():
+        raise ValueError(f"número inválido '{valor}'")
+    return int(numero)
+
+
+def booleano(valor):
+    if isinstance(valor, bool):
+        return valor
+    chave = normalizar(valor)
+    if chave in _VERDADEIRO:
+        return True
+    if chave in _FALSO:
+        return False
+    raise ValueError(f"use sim/não em vez de '{valor}'")
@@ -1,7 +1,9 @@
-from app import db, Escola, Serie, app
+from app import create_app, db, Escola, Serie, migracoes
+
+app = create_app()
 
 with app.app_context():
-    db.create_all()
+    migracoes.upgrade(db.engine)
     if not Escola.query.first():
         db.session.add_all([Escola(nome="Escola A"), Escola(nome="Escola B")])
     if not Serie.query.first():
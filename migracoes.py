@@ -0,0 +1,273 @@
+"""
+Migrações de schema numeradas, aplicadas fora do boot (flask db upgrade).
+
+Cada revisão é uma função registrada com @migrador.revisao(numero, nome)
+que recebe a conexão. A tabela schema_version guarda o número, o nome e o
+checksum (sha256 do código da função) de cada revisão aplicada:
+
+- upgrade aplica as pendentes em ordem, uma transação por revisão, junto
+  com a linha em schema_version. Antes de cada uma pega um lock (BEGIN
+  IMMEDIATE no SQLite, pg_advisory_xact_lock no Postgres) e relê o que já
+  foi aplicado, então dois processos rodando upgrade ao mesmo tempo não
+  aplicam a mesma revisão duas vezes;
+- revisão já aplicada cujo código mudou (checksum diferente), ou número no
+  banco que o código não conhece, fazem o upgrade parar (ErroMigracao).
+
+Revisão nova = função nova com o próximo número; não se edita revisão já
+publicada. Bancos novos nascem do create_all da revisão 1 (com o modelo
+atual), por isso colunas novas entram com adicionar_coluna, que não falha
+se a coluna já existe.
+
+Migrações de dados em tabelas grandes não cabem numa revisão (um UPDATE só
+seguraria o lock de escrita do banco inteiro). Para elas há os backfills
+(@migrador.backfill): a função recebe um intervalo de ids e é chamada lote
+a lote, cada lote na sua transação curta, com uma pausa entre eles. O
+último id feito fica em backfill_progresso, então dá para interromper e
+continuar depois do ponto onde parou (flask db backfill NOME).
+"""
+import hashlib
+import inspect
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, select, text
+from sqlalchemy import inspect as sa_inspect
+
+_metadata = MetaData()
+schema_version = Table(
+    "schema_version", _metadata,
+    Column("versao", Integer, primary_key=True, autoincrement=False),
+    Column("nome", String(120), nullable=False),
+    Column("checksum", String(64), nullable=False),
+    Column("aplicada_em", DateTime, nullable=False),
+)
+
+backfill_progresso = Table(
+    "backfill_progresso", _metadata,
+    Column("nome", String(80), primary_key=True),
+    Column("ultimo_id", Integer, nullable=False, default=0),
+    Column("processadas", Integer, nullable=False, default=0),
+    Column("iniciado_em", DateTime, nullable=False),
+    Column("atualizado_em", DateTime, nullable=False),
+    Column("concluido_em", DateTime),
+)
+
+CHAVE_LOCK_POSTGRES = 4_157_021   # qualquer inteiro fixo, só precisa ser o mesmo em todos
+
+
+class ErroMigracao(RuntimeError):
+    """Banco e revisões do código não batem; nada foi aplicado."""
+
+
+class Revisao:
+    def __init__(self, numero, nome, funcao):
+        self.numero = numero
+        self.nome = nome
+        self.funcao = funcao
+        fonte = inspect.getsource(funcao).replace("\r\n", "\n")
+        fonte = "\n".join(linha.rstrip() for linha in fonte.splitlines())
+        self.checksum = hashlib.sha256(fonte.encode("utf-8")).hexdigest()
+
+
+class Backfill:
+    def __init__(self, nome, tabela, funcao, preparar=None, ao_terminar=None):
+        self.nome = nome
+        self.tabela = tabela
+        self.funcao = funcao            # (conn, primeiro_id, ultimo_id, contexto)
+        self.preparar = preparar        # (conn) -> contexto; None = nada a fazer
+        self.ao_terminar = ao_terminar  # () -> None, depois do último lote
+
+
+class Migrador:
+    def __init__(self):
+        self.revisoes = {}
+        self.backfills = {}
+
+    def revisao(self, numero, nome):
+        def registrar(funcao):
+            if numero in self.revisoes:
+                raise ValueError(f"revisão {numero} registrada duas vezes")
+            self.revisoes[numero] = Revisao(numero, nome, funcao)
+            return funcao
+        return registrar
+
+    def backfill(self, nome, tabela, preparar=None, ao_terminar=None):
+        def registrar(funcao):
+            if nome in self.backfills:
+                raise ValueError(f"backfill {nome} registrado duas vezes")
+            self.backfills[nome] = Backfill(nome, tabela, funcao, preparar, ao_terminar)
+            return funcao
+        return registrar
+
+    @property
+    def ultima(self):
+        return max(self.revisoes, default=0)
+
+    # ---------------------------------------------------------------
+    @contextmanager
+    def _transacao(self, engine):
+        """Transação com lock exclusivo do schema durante a revisão."""
+        if engine.dialect.name == "sqlite":
+            # o pysqlite não abre transação antes de DDL; aqui abrimos na mão,
+            # assim ALTER/CREATE também voltam atrás se a revisão falhar
+            with engine.connect() as conn:
+                conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                try:
+                    yield conn
+                except BaseException:
+                    conn.exec_driver_sql("ROLLBACK")
+                    raise
+                conn.exec_driver_sql("COMMIT")
+        else:
+            with engine.begin() as conn:
+                if engine.dialect.name == "postgresql":
+                    conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": CHAVE_LOCK_POSTGRES})
+                yield conn
+
+    @staticmethod
+    def aplicadas(conn):
+        """{versao: checksum} do que está em schema_version ({} se a tabela não existe)."""
+        if not sa_inspect(conn).has_table("schema_version"):
+            return {}
+        return dict(conn.execute(select(schema_version.c.versao, schema_version.c.checksum)).all())
+
+    def divergencias(self, aplicadas):
+        erros = []
+        for versao, checksum in sorted(aplicadas.items()):
+            rev = self.revisoes.get(versao)
+            if rev is None:
+                erros.append(f"revisão {versao} aplicada no banco mas ausente do código")
+            elif rev.checksum != checksum:
+                erros.append(f"revisão {versao} ({rev.nome}) foi alterada depois de aplicada")
+        return erros
+
+    def status(self, engine):
+        """[(Revisao, checksum aplicado ou None)] em ordem, mais as divergências."""
+        with engine.connect() as conn:
+            aplicadas = self.aplicadas(conn)
+        linhas = [(self.revisoes[n], aplicadas.get(n)) for n in sorted(self.revisoes)]
+        return linhas, self.divergencias(aplicadas)
+
+    def upgrade(self, engine, ate=None, eco=print):
+        """Aplica as revisões pendentes (até `ate`, inclusive). Devolve quantas aplicou."""
+        ate = self.ultima if ate is None else ate
+        with engine.connect() as conn:
+            aplicadas = self.aplicadas(conn)
+        erros = self.divergencias(aplicadas)
+        if erros:
+            raise ErroMigracao("; ".join(erros))
+
+        feitas = 0
+        for numero in sorted(n for n in self.revisoes if n <= ate and n not in aplicadas):
+            rev = self.revisoes[numero]
+            with self._transacao(engine) as conn:
+                schema_version.create(conn, checkfirst=True)
+                aplicadas = self.aplicadas(conn)    # outro processo pode ter aplicado
+                erros = self.divergencias(aplicadas)
+                if erros:
+                    raise ErroMigracao("; ".join(erros))
+                if numero in aplicadas:
+                    continue
+                eco(f"aplicando {numero:04d} {rev.nome}...")
+                rev.funcao(conn)
+                conn.execute(schema_version.insert().values(
+                    versao=numero, nome=rev.nome, checksum=rev.checksum,
+                    aplicada_em=datetime.utcnow(),
+                ))
+            feitas += 1
+        return feitas
+
+    # ---------------------------------------------------------------
+    @staticmethod
+    def progresso(conn, nome):
+        if not sa_inspect(conn).has_table("backfill_progresso"):
+            return None
+        return conn.execute(
+            select(backfill_progresso).where(backfill_progresso.c.nome == nome)
+        ).mappings().first()
+
+    def rodar_backfill(self, engine, nome, lote=500, pausa=0.1, reiniciar=False, eco=print):
+        """
+        Roda (ou continua) o backfill `nome` em lotes de `lote` ids, dormindo
+        `pausa` s entre eles para as requisições do app não ficarem esperando
+        o lock. Devolve quantas linhas processou nesta chamada.
+        """
+        bf = self.backfills[nome]
+        pk = Table(bf.tabela, MetaData(), Column("id", Integer, primary_key=True)).c.id
+        agora = datetime.utcnow()
+
+        with engine.begin() as conn:
+            backfill_progresso.create(conn, checkfirst=True)
+            estado = self.progresso(conn, nome)
+            if estado is None or reiniciar:
+                conn.execute(backfill_progresso.delete().where(backfill_progresso.c.nome == nome))
+                conn.execute(backfill_progresso.insert().values(
+                    nome=nome, ultimo_id=0, processadas=0, iniciado_em=agora, atualizado_em=agora,
+                ))
+                estado = self.progresso(conn, nome)
+            if estado["concluido_em"] is not None:
+                eco(f"{nome}: já concluído em {estado['concluido_em']:%d/%m/%Y %H:%M}.")
+                return 0
+            contexto = bf.preparar(conn) if bf.preparar else True
+            ultimo_id = estado["ultimo_id"]
+            feitas_antes = estado["processadas"]
+            total = feitas_antes + conn.execute(
+                select(func.count()).select_from(pk.table).where(pk > ultimo_id)
+            ).scalar()
+
+        processadas = 0
+        t0 = time.monotonic()
+        while contexto is not None:
+            with engine.begin() as conn:
+                ids = conn.execute(
+                    select(pk).where(pk > ultimo_id).order_by(pk).limit(lote)
+                ).scalars().all()
+                if not ids:
+                    break
+                bf.funcao(conn, ids[0], ids[-1], contexto)
+                ultimo_id = ids[-1]
+                processadas += len(ids)
+                conn.execute(backfill_progresso.update().where(backfill_progresso.c.nome == nome).values(
+                    ultimo_id=ultimo_id,
+                    processadas=backfill_progresso.c.processadas + len(ids),
+                    atualizado_em=datetime.utcnow(),
+                ))
+            feito = feitas_antes + processadas
+            ritmo = processadas / max(time.monotonic() - t0, 1e-6)
+            falta = max(total - feito, 0) / ritmo
+            eco(f"{nome}: {feito}/{total} ({feito * 100 // max(total, 1)}%) "
+                f"até id {ultimo_id}, {ritmo:.0f} linhas/s, ~{falta:.0f} s restantes")
+            if len(ids) < lote:
+                break
+            time.sleep(pausa)
+
+        with engine.begin() as conn:
+            conn.execute(backfill_progresso.update().where(backfill_progresso.c.nome == nome).values(
+                concluido_em=datetime.utcnow(), atualizado_em=datetime.utcnow(),
+            ))
+        if bf.ao_terminar:
+            bf.ao_terminar()
+        eco(f"{nome}: concluído ({feitas_antes + processadas} linhas).")
+        return processadas
+
+
+# -------------------------------------------------------------------
+# Ajudantes para as revisões
+# -------------------------------------------------------------------
+def colunas(conn, tabela):
+    return {c["name"] for c in sa_inspect(conn).get_columns(tabela)}
+
+
+def adicionar_coluna(conn, tabela, coluna, ddl):
+    """ALTER TABLE ... ADD COLUMN, se a coluna ainda não existir."""
+    if coluna not in colunas(conn, tabela):
+        conn.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {ddl}"))
+
+
+def criar_indices(conn, metadata):
+    """Índices do modelo que ainda não existem (create_all não cria em tabela existente)."""
+    for tabela in metadata.sorted_tables:
+        for indice in tabela.indexes:
+            indice.create(conn, checkfirst=True)
@@ -0,0 +1,12 @@
+"""
+Valores do servidor usados por app.py e por gunicorn.conf.py. Sem
+dependências: o master do gunicorn lê este módulo sem importar o app.
+"""
+import os
+
+WORKERS_PADRAO = 2   # sem WEB_CONCURRENCY
+
+
+def workers() -> int:
+    """Workers do gunicorn (WEB_CONCURRENCY); o pool do banco é dividido por eles."""
+    return max(1, int(os.getenv("WEB_CONCURRENCY", str(WORKERS_PADRAO))))
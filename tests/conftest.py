@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def app_teste(tmp_path_factory):
+    """App com um SQLite vazio (schema pelas migrações) e o admin inicial."""
+    import app as modulo
+
+    banco = tmp_path_factory.mktemp("db") / "teste.db"
+    flask_app = modulo.create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{banco}",
+        "REF_CACHE_CHECK": 3600,    # versões dos caches relidas só após invalidar
+    })
+    with flask_app.app_context():
+        modulo.migracoes.upgrade(modulo.db.engine, eco=lambda m: None)
+        modulo.seed_admin()
+    return flask_app
+
+
+@pytest.fixture()
+def cliente(app_teste):
+    c = app_teste.test_client()
+    r = c.post("/login", data={"email": "admin@escola.com", "senha": "Trocar123"})
+    assert r.status_code == 302
+    return c
@@ -0,0 +1,76 @@
+"""
+Número de comandos SQL por listagem (g.n_consultas, contado em
+_contar_consulta): não pode crescer com a quantidade de linhas. Se um
+teste daqui falhar, alguma rota voltou a carregar relacionamentos um a um
+(N+1); confira os joinedload/selectinload da consulta.
+"""
+from datetime import date
+
+import pytest
+from flask import appcontext_tearing_down, g
+
+import app as A
+
+# endpoint -> máximo de comandos SQL numa requisição (com o usuário e os
+# caches de referência já carregados)
+LISTAGENS = {
+    "/alunos/": 1,
+    "/alunos/?stream=1": 1,
+    "/atividades/": 1,
+    "/horarios/": 2,
+    "/escolas/": 1,
+    "/series/": 1,
+    "/professores/": 2,
+    "/usuarios/": 2,
+    "/comunicados/": 1,
+}
+
+
+def _semear(n):
+    """Acrescenta n registros de cada tipo, com todos os relacionamentos preenchidos."""
+    inicio = A.db.session.query(A.Escola).count()
+    for i in range(inicio, inicio + n):
+        e = A.Escola(nome=f"Escola {i}")
+        s = A.Serie(nome=f"Série {i}")
+        h = A.Horario(hora_inicio=f"{i % 24:02d}:00", hora_fim=f"{i % 24:02d}:50")
+        A.db.session.add_all([e, s, h])
+        A.db.session.flush()
+        a = A.Aluno(nome=f"Aluno {i}", escola_id=e.id, serie_id=s.id, horario_id=h.id)
+        A.db.session.add(a)
+        A.db.session.flush()
+        A.db.session.add(A.Atividade(aluno_id=a.id, data=date(2025, 1, 1 + i % 28), professor="P", conteudo="c"))
+        u = A.Usuario(email=f"prof{i}@escola.com", senha_hash="x", papel="PROFESSOR", aluno_id=a.id)
+        A.db.session.add(u)
+        A.db.session.flush()
+        A.db.session.add(A.Professor(usuario_id=u.id, nome=f"Professor {i}", series=[s]))
+    A.db.session.commit()
+    A.invalidar_referencias("escolas", "series", "horarios", "alunos", "usuarios")
+
+
+def _consultas(cliente, app_teste, url):
+    contagens = []
+
+    def anotar(sender, **extra):
+        # no fim do contexto, depois de um eventual streaming do corpo
+        contagens.append(g.get("n_consultas", 0))
+
+    cliente.get(url).close()    # aquece usuário e caches de referência
+    with appcontext_tearing_down.connected_to(anotar, app_teste):
+        r = cliente.get(url)
+        r.get_data()
+        r.close()
+    assert r.status_code == 200, (url, r.status_code)
+    return contagens[-1]
+
+
+@pytest.mark.parametrize("url", LISTAGENS)
+def test_consultas_nao_crescem_com_as_linhas(app_teste, cliente, url):
+    with app_teste.app_context():
+        _semear(3)
+    poucas = _consultas(cliente, app_teste, url)
+    with app_teste.app_context():
+        _semear(30)
+    muitas = _consultas(cliente, app_teste, url)
+
+    assert muitas == poucas, f"{url}: {poucas} consultas com poucas linhas, {muitas} com mais"
+    assert muitas <= LISTAGENS[url], f"{url}: {muitas} consultas (máximo {LISTAGENS[url]})"
@@ -0,0 +1,119 @@
+"""PoolSMTP: reuso da sessão SMTP e quando ela é descartada."""
+import smtplib
+
+import pytest
+
+from transporte_email import PoolSMTP
+
+
+class SMTPFalso:
+    """Servidor de mentira: registra conexões, logins e envios."""
+
+    abertas = []
+
+    def __init__(self, host, porta, timeout=None):
+        self.logins = 0
+        self.enviadas = []
+        self.fechada = False
+        self.falhas = []        # exceções que os próximos sendmail levantam
+        self.resposta_noop = 250
+        SMTPFalso.abertas.append(self)
+
+    def ehlo(self):
+        return 250, b"ok"
+
+    def has_extn(self, nome):
+        return False
+
+    def login(self, usuario, senha):
+        self.logins += 1
+
+    def noop(self):
+        if self.resposta_noop != 250:
+            raise smtplib.SMTPServerDisconnected("conexão encerrada")
+        return 250, b"ok"
+
+    def sendmail(self, remetente, destinos, dados):
+        if self.falhas:
+            raise self.falhas.pop(0)
+        self.enviadas.extend(destinos)
+
+    def quit(self):
+        self.fechada = True
+
+    close = quit
+
+
+@pytest.fixture()
+def pool(monkeypatch):
+    SMTPFalso.abertas = []
+    monkeypatch.setattr(smtplib, "SMTP", SMTPFalso)
+    p = PoolSMTP("smtp.exemplo.com", 587, "escola@exemplo.com", "senha", tamanho=2)
+    yield p
+    p.fechar()
+
+
+def test_envios_seguidos_usam_uma_sessao(pool):
+    for i in range(5):
+        pool.enviar(f"resp{i}@exemplo.com", "Aviso", "corpo")
+
+    assert len(SMTPFalso.abertas) == 1
+    conexao = SMTPFalso.abertas[0]
+    assert conexao.logins == 1
+    assert len(conexao.enviadas) == 5
+
+
+def test_lote_usa_uma_sessao(pool):
+    resultados = pool.enviar_lote([(f"resp{i}@exemplo.com", "Aviso", "corpo") for i in range(10)])
+
+    assert resultados == [None] * 10
+    assert len(SMTPFalso.abertas) == 1
+
+
+@pytest.mark.parametrize("erro", [
+    smtplib.SMTPRecipientsRefused({"x@exemplo.com": (550, b"no such user")}),
+    smtplib.SMTPDataError(554, b"rejeitada"),
+    smtplib.SMTPSenderRefused(553, b"remetente", "escola@exemplo.com"),
+])
+def test_erro_de_comando_devolve_a_sessao_ao_pool(pool, erro):
+    pool.enviar("a@exemplo.com", "Aviso", "corpo")
+    SMTPFalso.abertas[0].falhas.append(erro)
+    with pytest.raises(type(erro)):
+        pool.enviar("x@exemplo.com", "Aviso", "corpo")
+    pool.enviar("b@exemplo.com", "Aviso", "corpo")
+
+    assert len(SMTPFalso.abertas) == 1
+    assert not SMTPFalso.abertas[0].fechada
+    assert SMTPFalso.abertas[0].enviadas == ["a@exemplo.com", "b@exemplo.com"]
+
+
+@pytest.mark.parametrize("erro", [
+    smtplib.SMTPServerDisconnected("caiu"),
+    ConnectionResetError("reset"),
+])
+def test_sessao_caida_e_descartada_e_reaberta(pool, erro):
+    pool.enviar("a@exemplo.com", "Aviso", "corpo")
+    SMTPFalso.abertas[0].falhas.append(erro)
+    if isinstance(erro, smtplib.SMTPServerDisconnected):
+        pool.enviar("b@exemplo.com", "Aviso", "corpo")     # reconecta sozinho
+    else:
+        with pytest.raises(ConnectionResetError):
+            pool.enviar("b@exemplo.com", "Aviso", "corpo")
+        pool.enviar("b@exemplo.com", "Aviso", "corpo")
+
+    primeira, segunda = SMTPFalso.abertas
+    assert primeira.fechada
+    assert segunda.enviadas == ["b@exemplo.com"]
+
+
+def test_sessao_parada_e_conferida_com_noop(pool):
+    pool.noop_apos = 0
+    pool.enviar("a@exemplo.com", "Aviso", "corpo")
+    pool.enviar("b@exemplo.com", "Aviso", "corpo")      # NOOP ok: mesma sessão
+    assert len(SMTPFalso.abertas) == 1
+
+    SMTPFalso.abertas[0].resposta_noop = 421
+    pool.enviar("c@exemplo.com", "Aviso", "corpo")      # NOOP falhou: sessão nova
+    assert len(SMTPFalso.abertas) == 2
+    assert SMTPFalso.abertas[0].fechada
+    assert SMTPFalso.abertas[1].enviadas == ["c@exemplo.com"]
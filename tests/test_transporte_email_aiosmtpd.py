@@ -0,0 +1,91 @@
+"""PoolSMTP contra um servidor SMTP de verdade (aiosmtpd, requirements-dev.txt)."""
+import socket
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from transporte_email import PoolSMTP
+
+
+class Caixa:
+    """Handler do aiosmtpd: guarda as mensagens e a sessão de cada uma."""
+
+    def __init__(self):
+        self.mensagens = []     # (sessão, remetente, destinos, conteúdo)
+
+    async def handle_RCPT(self, server, session, envelope, endereco, opcoes):
+        if endereco.startswith("inexistente"):
+            return "550 no such user"
+        envelope.rcpt_tos.append(endereco)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.mensagens.append(
+            (session, envelope.mail_from, envelope.rcpt_tos, envelope.content)
+        )
+        return "250 OK"
+
+
+def autenticar(server, session, envelope, mecanismo, dados):
+    ok = dados.login == b"escola@exemplo.com" and dados.password == b"senha"
+    return AuthResult(success=ok)
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture()
+def servidor():
+    caixa = Caixa()
+    controller = Controller(
+        caixa, hostname="127.0.0.1", port=porta_livre(),
+        authenticator=autenticar, auth_require_tls=False,
+    )
+    controller.start()
+    yield controller, caixa
+    controller.stop()
+
+
+@pytest.fixture()
+def pool(servidor):
+    controller, _ = servidor
+    p = PoolSMTP(controller.hostname, controller.port, "escola@exemplo.com", "senha")
+    yield p
+    p.fechar()
+
+
+def test_lote_entregue_numa_sessao(servidor, pool):
+    _, caixa = servidor
+    resultados = pool.enviar_lote(
+        [(f"resp{i}@exemplo.com", f"Aviso {i}", f"corpo {i}") for i in range(10)]
+    )
+
+    assert resultados == [None] * 10
+    assert [destinos for _, _, destinos, _ in caixa.mensagens] == [
+        [f"resp{i}@exemplo.com"] for i in range(10)
+    ]
+    assert all(remetente == "escola@exemplo.com" for _, remetente, _, _ in caixa.mensagens)
+    assert b"Subject: Aviso 3" in caixa.mensagens[3][3]
+    assert len({id(sessao) for sessao, _, _, _ in caixa.mensagens}) == 1
+
+
+def test_destinatario_recusado_nao_interrompe_o_lote(servidor, pool):
+    _, caixa = servidor
+    resultados = pool.enviar_lote([
+        ("a@exemplo.com", "Aviso", "corpo"),
+        ("inexistente@exemplo.com", "Aviso", "corpo"),
+        ("b@exemplo.com", "Aviso", "corpo"),
+    ])
+
+    assert resultados[0] is None and resultados[2] is None
+    assert resultados[1].startswith("SMTPRecipientsRefused")
+    assert [destinos for _, _, destinos, _ in caixa.mensagens] == [
+        ["a@exemplo.com"], ["b@exemplo.com"]
+    ]
+    assert len({id(sessao) for sessao, _, _, _ in caixa.mensagens}) == 1
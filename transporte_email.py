@@ -0,0 +1,232 @@
+"""
+Transporte de e-mail com conexões reaproveitadas.
+
+- PoolSMTP: mantém sessões SMTP abertas (login uma vez só) e as devolve ao
+  pool depois de cada envio. Antes de reutilizar uma sessão parada há algum
+  tempo, manda um NOOP; se o servidor já fechou, abre outra.
+- ClienteResend: um requests.Session compartilhado (keep-alive/TLS reusado)
+  e envio em lote pelo endpoint /emails/batch.
+
+Os dois têm enviar_lote(mensagens), que devolve uma lista com None (enviado)
+ou a mensagem de erro de cada item, na mesma ordem.
+"""
+import smtplib
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from email.mime.text import MIMEText
+
+
+class PoolSMTP:
+    """Pool de conexões SMTP autenticadas, seguro para várias threads."""
+
+    def __init__(self, host, porta, usuario, senha, remetente=None, tamanho=2,
+                 timeout=20, ocioso_max=60, noop_apos=5):
+        self.host = host
+        self.porta = porta
+        self.usuario = usuario
+        self.senha = senha
+        self.remetente = remetente or usuario
+        self.tamanho = tamanho
+        self.timeout = timeout
+        self.ocioso_max = ocioso_max    # s parado -> fecha em vez de reusar
+        self.noop_apos = noop_apos      # s parado -> confere com NOOP antes de usar
+        self._livres = []               # [(conexao, ultimo_uso)]
+        self._abertas = 0
+        self._cond = threading.Condition()
+
+    def _conectar(self):
+        if self.porta == 465:
+            conexao = smtplib.SMTP_SSL(self.host, self.porta, timeout=self.timeout)
+        else:
+            conexao = smtplib.SMTP(self.host, self.porta, timeout=self.timeout)
+            conexao.ehlo()
+            if conexao.has_extn("starttls"):
+                conexao.starttls()
+                conexao.ehlo()
+        if self.usuario:
+            conexao.login(self.usuario, self.senha)
+        return conexao
+
+    @staticmethod
+    def _viva(conexao):
+        try:
+            return conexao.noop()[0] == 250
+        except OSError:     # SMTPException é subclasse: qualquer falha no NOOP = morta
+            return False
+
+    @staticmethod
+    def _fechar(conexao):
+        try:
+            conexao.quit()
+        except Exception:
+            try:
+                conexao.close()
+            except Exception:
+                pass
+
+    def _pegar(self):
+        with self._cond:
+            while True:
+                if self._livres:
+                    conexao, ultimo_uso = self._livres.pop()
+                    break
+                if self._abertas < self.tamanho:
+                    self._abertas += 1
+                    conexao = None
+                    break
+                self._cond.wait()
+
+        if conexao is not None:
+            parada = time.monotonic() - ultimo_uso
+            if parada <= self.ocioso_max and (parada < self.noop_apos or self._viva(conexao)):
+                return conexao
+            self._fechar(conexao)
+
+        try:
+            return self._conectar()
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+            raise
+
+    def _devolver(self, conexao, reutilizar=True):
+        with self._cond:
+            if reutilizar:
+                self._livres.append((conexao, time.monotonic()))
+            else:
+                self._abertas -= 1
+            self._cond.notify()
+        if not reutilizar:
+            self._fechar(conexao)
+
+    @contextmanager
+    def conexao(self):
+        conexao = self._pegar()
+        try:
+            yield conexao
+        except (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout):
+            # sessão/socket caiu: descarta
+            self._devolver(conexao, reutilizar=False)
+            raise
+        except BaseException:
+            # erro do comando (SMTPResponseException, destinatário recusado...):
+            # o servidor respondeu, a sessão continua boa
+            self._devolver(conexao)
+            raise
+        else:
+            self._devolver(conexao)
+
+    def _montar(self, destinos, assunto, corpo):
+        msg = MIMEText(corpo)
+        msg["Subject"] = assunto or ""
+        msg["From"] = self.remetente
+        msg["To"] = ", ".join(destinos)
+        return msg.as_string()
+
+    def enviar(self, destinos, assunto, corpo):
+        """Envia uma mensagem; uma reconexão se o servidor tiver derrubado a sessão."""
+        if isinstance(destinos, str):
+            destinos = [destinos]
+        dados = self._montar(destinos, assunto, corpo)
+        for tentativa in (1, 2):
+            try:
+                with self.conexao() as conexao:
+                    conexao.sendmail(self.usuario or self.remetente, destinos, dados)
+                return
+            except smtplib.SMTPServerDisconnected:
+                if tentativa == 2:
+                    raise
+
+    def enviar_lote(self, mensagens):
+        """
+        mensagens: iterável de (destino, assunto, corpo). Usa uma sessão para
+        o lote inteiro; se ela cair no meio, reconecta e segue do ponto onde parou.
+        """
+        mensagens = list(mensagens)
+        resultados = [None] * len(mensagens)
+        i = 0
+        reconexoes = 0
+        while i < len(mensagens):
+            try:
+                with self.conexao() as conexao:
+                    while i < len(mensagens):
+                        destino, assunto, corpo = mensagens[i]
+                        destinos = [destino] if isinstance(destino, str) else list(destino)
+                        try:
+                            conexao.sendmail(
+                                self.usuario or self.remetente, destinos,
+                                self._montar(destinos, assunto, corpo),
+                            )
+                        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError,
+                                smtplib.SMTPSenderRefused) as e:
+                            resultados[i] = f"{type(e).__name__}: {e}"
+                        i += 1
+            except (smtplib.SMTPException, OSError) as e:
+                reconexoes += 1
+                if reconexoes > 2:
+                    erro = f"{type(e).__name__}: {e}"
+                    for j in range(i, len(mensagens)):
+                        resultados[j] = erro
+                    break
+        return resultados
+
+    def fechar(self):
+        with self._cond:
+            livres, self._livres = self._livres, []
+            self._abertas -= len(livres)
+        for conexao, _ in livres:
+            self._fechar(conexao)
+
+
+class ClienteResend:
+    """Cliente da API HTTP do Resend com sessão (e conexões TLS) compartilhada."""
+
+    URL = "https://api.resend.com"
+    LOTE_MAX = 100    # limite do /emails/batch
+
+    def __init__(self, api_key, remetente, tamanho=4, timeout=20):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.remetente = remetente
+        self.timeout = timeout
+        self.sessao = requests.Session()
+        self.sessao.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=tamanho)
+        self.sessao.mount("https://", adaptador)
+
+    def _corpo(self, destinos, assunto, texto):
+        if isinstance(destinos, str):
+            destinos = [destinos]
+        return {"from": self.remetente, "to": list(destinos), "subject": assunto, "text": texto}
+
+    def enviar(self, destinos, assunto, texto):
+        r = self.sessao.post(
+            f"{self.URL}/emails", json=self._corpo(destinos, assunto, texto), timeout=self.timeout
+        )
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"Resend {r.status_code}: {r.text}")
+
+    def enviar_lote(self, mensagens):
+        mensagens = list(mensagens)
+        resultados = [None] * len(mensagens)
+        for ini in range(0, len(mensagens), self.LOTE_MAX):
+            parte = mensagens[ini:ini + self.LOTE_MAX]
+            try:
+                r = self.sessao.post(
+                    f"{self.URL}/emails/batch",
+                    json=[self._corpo(*m) for m in parte],
+                    timeout=self.timeout,
+                )
+                erro = None if r.status_code in (200, 201) else f"Resend {r.status_code}: {r.text}"
+            except Exception as e:
+                erro = f"{type(e).__name__}: {e}"
+            if erro:
+                resultados[ini:ini + len(parte)] = [erro] * len(parte)
+        return resultados